@@ -0,0 +1,72 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from fastapi import Depends, HTTPException
+from fastapi.security import OAuth2PasswordBearer
+
+from app.store import GameStore
+from app.utils import decode_access_token, get_token_id, get_token_role
+
+
+# Проверка токенов админов и ведущих. Проверенные токены хранятся в ограниченном LRU-кеше
+# по хешу токена до истечения срока действия, поэтому повторные запросы не проверяют подпись заново.
+# Отзыв проверяется при каждом запросе, так как токен может быть отозван в другом воркере
+class TokenAuthorizer:
+    def __init__(self, store: GameStore, scheme: OAuth2PasswordBearer, cache_size: int):
+        self.store = store
+        self.scheme = scheme
+        self.cache_size = cache_size
+        # хеш токена -> данные токена
+        self.cache: "OrderedDict[bytes, dict]" = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    # Данные проверенного токена из кеша, None - токена нет в кеше или срок его действия истек
+    def _cached(self, key: bytes) -> Optional[dict]:
+        payload = self.cache.get(key)
+        if payload is None:
+            return None
+        if payload.get("exp", 0) <= time.time():
+            del self.cache[key]
+            return None
+        self.cache.move_to_end(key)
+        return payload
+
+    def _remember(self, key: bytes, payload: dict):
+        if self.cache_size <= 0 or "exp" not in payload:
+            return
+        self.cache[key] = payload
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    # Удаление токена из кеша (например, при выходе)
+    def forget(self, token: str):
+        self.cache.pop(self._key(token), None)
+
+    # Проверка токена: подпись, срок действия и отзыв. Возвращает данные токена
+    async def verify(self, token: str) -> dict:
+        key = self._key(token)
+        payload = self._cached(key)
+        if payload is None:
+            payload = decode_access_token(token)
+            self._remember(key, payload)
+        if await self.store.is_token_revoked(get_token_id(token, payload)):
+            self.cache.pop(key, None)
+            raise HTTPException(status_code=401, detail="Token has been revoked")
+        return payload
+
+    # Зависимость FastAPI, пропускающая только токены с одной из ролей roles
+    def require(self, *roles: str) -> Callable:
+        detail = f'{" or ".join(role.capitalize() for role in roles)} privileges required'
+
+        async def dependency(token: str = Depends(self.scheme)) -> dict:
+            payload = await self.verify(token)
+            if get_token_role(payload) not in roles:
+                raise HTTPException(status_code=403, detail=detail)
+            return payload
+
+        return dependency
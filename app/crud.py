@@ -1,59 +1,300 @@
-from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, insert, select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import models, schemas
 
 
 # Создание новой категории
-def create_category(db: Session, category: schemas.CategoryCreate):
+async def create_category(db: AsyncSession, category: schemas.CategoryCreate):
     db_category = models.Category(name=category.name, color=category.color)
     db.add(db_category)
-    db.commit()
-    db.refresh(db_category)
+    await db.commit()
+    await db.refresh(db_category)
     return db_category
 
 
+# Загрузка объектов по списку id одним запросом: id -> объект, отсутствующих id нет в словаре
+async def get_by_ids(db: AsyncSession, model, ids: Iterable[int]) -> Dict[int, object]:
+    ids = set(ids)
+    if not ids:
+        return {}
+    return {obj.id: obj for obj in await db.scalars(select(model).where(model.id.in_(ids)))}
+
+
 # Получение админа
-def get_admin(db: Session, admin: schemas.UserLogin):
-    return db.query(models.Admin).filter(admin.login == models.Admin.login).first()
+async def get_admin(db: AsyncSession, admin: schemas.UserLogin):
+    return await db.scalar(select(models.Admin).where(admin.login == models.Admin.login))
+
 
+# Страница списка по ключу (keyset): строки с id больше after_id в порядке id.
+# Время не зависит от номера страницы, так как строки ищутся по первичному ключу.
+# Возвращает строки и курсор следующей страницы (None - страница последняя)
+async def get_page(db: AsyncSession, statement, id_column, after_id: Optional[int],
+                   limit: int) -> Tuple[list, Optional[int]]:
+    if after_id is not None:
+        statement = statement.where(id_column > after_id)
+    rows = list(await db.execute(statement.order_by(id_column).limit(limit + 1)))
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_cursor
 
-# Получение всех категорий
-def get_categories(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Category).offset(skip).limit(limit).all()
+
+# Страница категорий, name_prefix - начало названия
+async def get_categories(db: AsyncSession, after_id: Optional[int] = None, limit: int = 100,
+                         name_prefix: Optional[str] = None):
+    statement = select(models.Category.id, models.Category.name, models.Category.color)
+    if name_prefix:
+        statement = statement.where(models.Category.name.startswith(name_prefix, autoescape=True))
+    return await get_page(db, statement, models.Category.id, after_id, limit)
 
 
 # Получение категории по ID
-def get_category(db: Session, category_id: int):
-    return db.query(models.Category).filter(models.Category.id == category_id).first()
+async def get_category(db: AsyncSession, category_id: int):
+    return await db.scalar(select(models.Category).where(models.Category.id == category_id))
 
 
-# Создание новой игры
-def create_game(db: Session, game: schemas.GameCreate):
-    db_game = models.Game(
-        name=game.name,
-        host_login=game.host_login,
-        host_password=game.host_password,
-        sets=game.sets,
-        tags=game.tags
+# Выделение count следующих номеров карточек категории. Счетчик card_seq увеличивается одним UPDATE
+# в текущей транзакции, поэтому одновременные добавления получают разные номера.
+# Возвращает первый выделенный номер, None - категории нет
+async def reserve_card_numbers(db: AsyncSession, category_id: int, count: int = 1) -> Optional[int]:
+    category = models.Category.__table__
+    statement = update(category).where(category.c.id == category_id).values(card_seq=category.c.card_seq + count)
+    if db.bind.dialect.update_returning:
+        last = await db.scalar(statement.returning(category.c.card_seq))
+    else:
+        await db.execute(statement)
+        last = await db.scalar(select(category.c.card_seq).where(category.c.id == category_id))
+    return None if last is None else last - count + 1
+
+
+# Поднятие счетчика номеров категории до number, если карточки добавлены с заданными номерами
+async def raise_card_seq(db: AsyncSession, category_id: int, number: int):
+    category = models.Category.__table__
+    await db.execute(
+        update(category).where(category.c.id == category_id, category.c.card_seq < number).values(card_seq=number)
     )
-    db.add(db_game)
-    db.commit()
-    db.refresh(db_game)
 
-    # Добавление категорий в игру
-    for category_id in game.categories:
-        db_category = db.query(models.Category).filter(models.Category.id == category_id).first()
-        if db_category:
-            db_game.categories.append(db_category)
 
-    db.commit()
+# Создание новой игры
+async def create_game(db: AsyncSession, game: schemas.GameCreate):
+    db_game = models.Game(name=game.name)
+    await set_game_hashtags(db, db_game, game.hashtags)
+    db_game.sets = (await db.scalars(select(models.Set).where(models.Set.id.in_(game.sets)))).all()
+    # Добавление категорий в игру
+    db_game.categories = (await db.scalars(
+        select(models.Category).where(models.Category.id.in_(game.categories)))).all()
+    db.add(db_game)
+    await db.commit()
     return db_game
 
 
-# Получение всех игр
-def get_games(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Game).offset(skip).limit(limit).all()
+# Страница игр, status - статус игры, name_prefix - начало названия
+async def get_games(db: AsyncSession, after_id: Optional[int] = None, limit: int = 100,
+                    status: Optional[str] = None, name_prefix: Optional[str] = None):
+    statement = select(models.Game.id, models.Game.name, models.Game.status)
+    if status:
+        statement = statement.where(models.Game.status == status)
+    if name_prefix:
+        statement = statement.where(models.Game.name.startswith(name_prefix, autoescape=True))
+    return await get_page(db, statement, models.Game.id, after_id, limit)
+
+
+# Страница ведущих, login_prefix - начало логина
+async def get_hosts(db: AsyncSession, after_id: Optional[int] = None, limit: int = 100,
+                    login_prefix: Optional[str] = None):
+    statement = select(models.Host.id, models.Host.login)
+    if login_prefix:
+        statement = statement.where(models.Host.login.startswith(login_prefix, autoescape=True))
+    return await get_page(db, statement, models.Host.id, after_id, limit)
 
 
 # Получение игры по ID
-def get_game(db: Session, game_id: int):
-    return db.query(models.Game).filter(models.Game.id == game_id).first()
+async def get_game(db: AsyncSession, game_id: int):
+    return await db.scalar(select(models.Game).where(models.Game.id == game_id))
+
+
+# Разбор списка хештегов: без пустых и повторяющихся значений
+def normalize_hashtags(hashtags: Iterable[str]) -> List[str]:
+    return list(dict.fromkeys(h for h in hashtags if h))
+
+
+# Получение хештегов по названиям, недостающие хештеги создаются
+async def get_or_create_hashtags(db: AsyncSession, names: Iterable[str]) -> List[models.Hashtag]:
+    names = normalize_hashtags(names)
+    if not names:
+        return []
+    hashtags = {h.name: h for h in await db.scalars(select(models.Hashtag).where(models.Hashtag.name.in_(names)))}
+    for name in names:
+        if name not in hashtags:
+            hashtags[name] = models.Hashtag(name=name)
+            db.add(hashtags[name])
+    await db.flush()
+    return [hashtags[name] for name in names]
+
+
+# id хештегов по названиям для массовых операций, недостающие хештеги создаются одним запросом
+async def get_or_create_hashtag_ids(db: AsyncSession, names: Iterable[str]) -> Dict[str, int]:
+    names = set(normalize_hashtags(names))
+    if not names:
+        return {}
+    hashtag_ids = dict((await db.execute(
+        select(models.Hashtag.name, models.Hashtag.id).where(models.Hashtag.name.in_(names)))).all())
+    missing = names - hashtag_ids.keys()
+    if missing:
+        result = await db.execute(
+            insert(models.Hashtag).returning(models.Hashtag.name, models.Hashtag.id),
+            [{"name": name} for name in missing]
+        )
+        hashtag_ids.update(result.all())
+    return hashtag_ids
+
+
+# Изменение счетчиков карточек у хештегов
+async def _add_hashtag_card_count(db: AsyncSession, hashtag_ids, delta: int):
+    if hashtag_ids:
+        await db.execute(
+            update(models.Hashtag)
+            .where(models.Hashtag.id.in_(hashtag_ids))
+            .values(card_count=models.Hashtag.card_count + delta)
+            .execution_options(synchronize_session=False)
+        )
+
+
+# Установка хештегов карточки с обновлением счетчиков каталога хештегов
+async def set_card_hashtags(db: AsyncSession, card: models.Card, hashtags: List[str]):
+    old_ids = {h.id for h in await card.awaitable_attrs.tags}
+    card.hashtags = ",".join(hashtags)
+    card.tags = await get_or_create_hashtags(db, hashtags)
+    new_ids = {h.id for h in card.tags}
+    await _add_hashtag_card_count(db, new_ids - old_ids, 1)
+    await _add_hashtag_card_count(db, old_ids - new_ids, -1)
+
+
+# Удаление связей карточек с хештегами перед удалением карточек, счетчики каталога уменьшаются.
+# card_ids - список id или подзапрос
+async def release_card_hashtags(db: AsyncSession, card_ids):
+    association = models.CardHashtagAssociation
+    removed = (
+        select(func.count())
+        .where(association.hashtag_id == models.Hashtag.id, association.card_id.in_(card_ids))
+        .scalar_subquery()
+    )
+    await db.execute(
+        update(models.Hashtag)
+        .where(models.Hashtag.id.in_(select(association.hashtag_id).where(association.card_id.in_(card_ids))))
+        .values(card_count=models.Hashtag.card_count - removed)
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        delete(association).where(association.card_id.in_(card_ids)).execution_options(synchronize_session=False)
+    )
+
+
+# Удаление карточек со связями с наборами и хештегами несколькими запросами.
+# card_ids - список id или подзапрос, который не зависит от удаляемых связей
+async def remove_cards(db: AsyncSession, card_ids):
+    await release_card_hashtags(db, card_ids)
+    await db.execute(
+        delete(models.SetCardAssociation).where(models.SetCardAssociation.card_id.in_(card_ids))
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        delete(models.Card).where(models.Card.id.in_(card_ids)).execution_options(synchronize_session=False)
+    )
+
+
+# Удаление наборов вместе со связями с карточками и играми. Карточки наборов не удаляются
+async def remove_sets(db: AsyncSession, set_ids):
+    for association in (models.SetCardAssociation, models.GameSetAssociation):
+        await db.execute(
+            delete(association).where(association.set_id.in_(set_ids)).execution_options(synchronize_session=False)
+        )
+    await db.execute(delete(models.Set).where(models.Set.id.in_(set_ids)).execution_options(synchronize_session=False))
+
+
+# Удаление категории со всеми наборами, карточками и связями с играми
+async def remove_category(db: AsyncSession, category_id: int):
+    await remove_sets(db, select(models.Set.id).where(models.Set.category_id == category_id))
+    await remove_cards(db, select(models.Card.id).where(models.Card.category_id == category_id))
+    await db.execute(
+        delete(models.GameCategoryAssociation).where(models.GameCategoryAssociation.category_id == category_id)
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        delete(models.Category).where(models.Category.id == category_id).execution_options(synchronize_session=False)
+    )
+
+
+# Удаление игры вместе со связями с категориями, наборами, хештегами и журналом вытягиваний
+async def remove_game(db: AsyncSession, game_id: int):
+    for association in (models.GameCategoryAssociation, models.GameSetAssociation, models.GameHashtagAssociation,
+                        models.GameDraw):
+        await db.execute(
+            delete(association).where(association.game_id == game_id).execution_options(synchronize_session=False)
+        )
+    await db.execute(delete(models.Game).where(models.Game.id == game_id).execution_options(synchronize_session=False))
+
+
+# Удаление журнала вытягиваний игры (записей всех ее запусков)
+async def remove_draws(db: AsyncSession, game_id: int):
+    await db.execute(
+        delete(models.GameDraw).where(models.GameDraw.game_id == game_id).execution_options(synchronize_session=False)
+    )
+
+
+# Установка хештегов игры
+async def set_game_hashtags(db: AsyncSession, game: models.Game, hashtags: List[str]):
+    await game.awaitable_attrs.tags
+    game.hashtags = ",".join(hashtags)
+    game.tags = await get_or_create_hashtags(db, hashtags)
+
+
+# Карточки для колоды игры: карточки из наборов игры, у которых есть хотя бы один из хештегов игры.
+# Выполняется одним запросом по индексам связей, возвращает пары (id карточки, id категории)
+async def get_deck_cards(db: AsyncSession, game_id: int) -> List[Tuple[int, int]]:
+    game_hashtags = select(models.GameHashtagAssociation.hashtag_id).where(
+        models.GameHashtagAssociation.game_id == game_id)
+    game_sets = select(models.GameSetAssociation.set_id).where(models.GameSetAssociation.game_id == game_id)
+    result = await db.execute(
+        select(models.Card.id, models.Card.category_id)
+        .join(models.CardHashtagAssociation, models.CardHashtagAssociation.card_id == models.Card.id)
+        .join(models.SetCardAssociation, models.SetCardAssociation.card_id == models.Card.id)
+        .where(models.CardHashtagAssociation.hashtag_id.in_(game_hashtags),
+               models.SetCardAssociation.set_id.in_(game_sets))
+        .distinct()
+    )
+    return [tuple(row) for row in result]
+
+
+# Каталог хештегов: названия хештегов, которые есть хотя бы у одной карточки
+async def get_hashtag_catalog(db: AsyncSession) -> List[str]:
+    return list(await db.scalars(select(models.Hashtag.name).where(models.Hashtag.card_count > 0)))
+
+
+# Смена статуса игры, только если он еще равен status (сравнение с обменом одним UPDATE).
+# Вместе со статусом записываются values. False - статус уже изменил другой запрос
+async def change_game_status(db: AsyncSession, game_id: int, status: str, new_status: str, **values) -> bool:
+    game = models.Game.__table__
+    result = await db.execute(
+        update(game).where(game.c.id == game_id, game.c.status == status).values(status=new_status, **values)
+    )
+    return result.rowcount == 1
+
+
+# Сброс запущенных игр, начатых раньше cutoff: игра возвращается в ожидание, колода удаляется.
+# Выполняется одним UPDATE по индексу (status, start_time), возвращает id сброшенных игр
+async def expire_games(db: AsyncSession, cutoff: datetime, game_id: Optional[int] = None) -> List[int]:
+    game = models.Game.__table__
+    condition = (game.c.status == "started") & (game.c.start_time < cutoff)
+    if game_id is not None:
+        condition &= game.c.id == game_id
+    values = {"status": "waiting", "start_time": None, "seed": None, "deck": None, "initial_deck": None}
+    if db.bind.dialect.update_returning:
+        game_ids = list(await db.scalars(update(game).where(condition).values(values).returning(game.c.id)))
+    else:
+        game_ids = list(await db.scalars(select(game.c.id).where(condition)))
+        if game_ids:
+            await db.execute(update(game).where(condition, game.c.id.in_(game_ids)).values(values))
+    await db.commit()
+    return game_ids
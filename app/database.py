@@ -1,13 +1,72 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-DATABASE_URL = "sqlite:///./test.db"  # Важно, что база данных будет сохраняться в файл
+
+from app import config
+
+DATABASE_URL = config.DATABASE_URL  # По умолчанию база данных сохраняется в файл
+
+# Асинхронные драйверы для адресов без явно указанного драйвера
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+
+# Адрес базы данных для асинхронного драйвера
+def get_async_database_url(url: str) -> str:
+    if config.ASYNC_DATABASE_URL:
+        return config.ASYNC_DATABASE_URL
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"Set ASYNC_DATABASE_URL for database backend {backend}")
+    return parsed.set(drivername=f'{backend}+{ASYNC_DRIVERS[backend]}').render_as_string(hide_password=False)
+
+
+# Параметры пула соединений
+def get_engine_options(url: str) -> dict:
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+        "pool_pre_ping": parsed.get_backend_name() != "sqlite",
+    }
+
+
+# Настройка SQLite для каждого нового соединения
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}')
+    cursor.execute(f'PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}')
+    cursor.execute(f'PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT}')
+    cursor.execute(f'PRAGMA cache_size={config.SQLITE_CACHE_SIZE}')
+    cursor.close()
+
+
+def configure_engine(engine: Engine):
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", set_sqlite_pragmas)
+
 
 # Создаем подключение к базе данных
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **get_engine_options(DATABASE_URL))
+configure_engine(engine)
+# Асинхронное подключение, используется в обработчиках запросов
+async_engine = create_async_engine(get_async_database_url(DATABASE_URL), **get_engine_options(DATABASE_URL))
+configure_engine(async_engine.sync_engine)
 
 # Создаем базовый класс для всех моделей
 Base = declarative_base()
 
-# Создаем сессию для работы с базой данных
+# Создаем сессию для работы с базой данных (миграции и скрипты)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Асинхронная сессия. Объекты не сбрасываются после commit, чтобы чтение атрибутов не обращалось к базе
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
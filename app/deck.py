@@ -0,0 +1,187 @@
+import random
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# Тип элемента массива id карточек: 32-битное беззнаковое число
+WORD = "I" if array("I").itemsize == 4 else "L"
+# Начало двоичного значения колоды, отличает его от текстовых колод старого формата
+BINARY_MAGIC = b"DCK1"
+
+
+# Случайное число для вытягивания номер seq в игре с зерном seed. Генератор создается
+# заново для каждого вытягивания, поэтому результат не зависит от того, какой воркер его выполняет,
+# и колоду можно восстановить, повторив вытягивания из журнала
+def draw_index(seed: int, seq: int, size: int) -> int:
+    return random.Random(f'{seed}:{seq}').randrange(size)
+
+
+# Копия id карточек в изменяемом массиве. memoryview копируется одним вызовом frombytes
+def _to_array(ids: Sequence[int]) -> array:
+    if isinstance(ids, memoryview):
+        copy = array(WORD)
+        copy.frombytes(ids.cast("B"))
+        return copy
+    return array(WORD, ids)
+
+
+# Колода игры: для каждой категории оставшиеся карточки и пул для пополнения, взятый из начальной колоды.
+# Очереди и пулы - списки, массивы id или memoryview над сохраненной колодой (только для чтения).
+# draws - число вытягиваний, сделанных с момента запуска игры
+class Deck:
+    def __init__(self, queues: Dict[int, Sequence[int]], pools: Dict[int, Sequence[int]],
+                 seed: int = 0, draws: int = 0):
+        self.queues = queues
+        self.pools = pools
+        self.seed = seed
+        self.draws = draws
+
+    # Построение колоды из пар (id карточки, id категории). Перемешивание не нужно:
+    # каждое вытягивание выбирает случайную из оставшихся карточек
+    @classmethod
+    def build(cls, cards: Iterable[Tuple[int, int]], seed: int) -> "Deck":
+        pools: Dict[int, array] = {}
+        for card_id, category_id in cards:
+            pools.setdefault(category_id, array(WORD)).append(card_id)
+        return cls({category_id: _to_array(pool) for category_id, pool in pools.items()}, pools, seed)
+
+    # Вытягивание карточки из категории за O(1): выбранная карточка заменяется последней.
+    # Если карточки категории закончились, очередь пополняется из начальной колоды.
+    # None - в категории нет карточек
+    def draw(self, category_id: int) -> Optional[int]:
+        queue = self._queue(category_id)
+        if queue is None:
+            return None
+        index = draw_index(self.seed, self.draws, len(queue))
+        card_id = queue[index]
+        queue[index] = queue[-1]
+        queue.pop()
+        self.draws += 1
+        return card_id
+
+    # Изменяемая очередь категории, пополненная из пула, если она пуста. None - в категории нет карточек
+    def _queue(self, category_id: int, refill: bool = False) -> Optional[array]:
+        queue = self.queues.get(category_id)
+        if not queue or refill:
+            pool = self.pools.get(category_id)
+            if not pool:
+                return None
+            queue = self.queues[category_id] = _to_array(pool)
+        elif isinstance(queue, memoryview):
+            # Очередь, загруженная из сохраненной колоды, копируется при первом изменении
+            queue = self.queues[category_id] = _to_array(queue)
+        return queue
+
+    # Вытягивание по одной карточке из каждой категории списка, по порядку. Для каждой категории
+    # возвращает (зерно, номер вытягивания, id карточки) или None, если в категории нет карточек
+    def draw_many(self, category_ids: Iterable[int]) -> List[Optional[Tuple[int, int, int]]]:
+        drawn = []
+        for category_id in category_ids:
+            seq = self.draws
+            card_id = self.draw(category_id)
+            drawn.append(None if card_id is None else (self.seed, seq, card_id))
+        return drawn
+
+    # Повторение вытягиваний из журнала: (номер вытягивания, id категории, id карточки) по возрастанию номера.
+    # Из очереди удаляется записанная в журнале карточка. Позиция берется из генератора, как при вытягивании,
+    # а если журнал неполон и на этой позиции другая карточка - ищется в очереди. Карточки нет в очереди -
+    # пропущенные вытягивания исчерпали очередь, и она пополняется из пула
+    def replay(self, draws: Iterable[Tuple[int, int, int]]):
+        for seq, category_id, card_id in draws:
+            self.draws = seq + 1
+            queue = self._queue(category_id)
+            if queue is None:
+                continue
+            index = draw_index(self.seed, seq, len(queue))
+            if queue[index] != card_id:
+                if card_id not in queue:
+                    queue = self._queue(category_id, refill=True)
+                    if card_id not in queue:
+                        continue
+                index = queue.index(card_id)
+            queue[index] = queue[-1]
+            queue.pop()
+
+    # Сериализация в двоичный вид: BINARY_MAGIC, затем 32-битные беззнаковые числа (little-endian):
+    # число категорий и для каждой категории ее id, число карточек и id карточек
+    @staticmethod
+    def _dump(groups: Dict[int, Sequence[int]]) -> bytes:
+        words = array(WORD, [len(groups)])
+        for category_id, ids in groups.items():
+            words.append(category_id)
+            words.append(len(ids))
+            if isinstance(ids, memoryview):
+                words.frombytes(ids.cast("B"))
+            else:
+                words.extend(ids if isinstance(ids, array) else array(WORD, ids))
+        if sys.byteorder != "little":
+            words.byteswap()
+        return BINARY_MAGIC + words.tobytes()
+
+    # Разбор двоичного значения без копирования буфера: id карточек каждой категории - memoryview
+    # над значением колоды (на машинах с порядком байтов big-endian значение копируется один раз)
+    @staticmethod
+    def _load_binary(value: bytes) -> Dict[int, memoryview]:
+        raw = memoryview(value)[len(BINARY_MAGIC):]
+        if sys.byteorder != "little":
+            swapped = array(WORD)
+            swapped.frombytes(raw)
+            swapped.byteswap()
+            raw = memoryview(swapped).cast("B")
+        words = raw.cast(WORD)
+        groups: Dict[int, memoryview] = {}
+        position = 1
+        for _ in range(words[0]):
+            category_id, count = words[position], words[position + 1]
+            position += 2
+            groups[category_id] = words[position:position + count]
+            position += count
+        return groups
+
+    # Разбор текстовых колод, сохраненных до перехода на двоичный формат:
+    # "категория:id,id;категория:id" и более старый "id.категория,id.категория"
+    @staticmethod
+    def _load_text(value: str) -> Dict[int, array]:
+        groups: Dict[int, array] = {}
+        if ':' not in value:
+            for token in value.split(','):
+                card_id, category_id = token.split('.')
+                groups.setdefault(int(category_id), array(WORD)).append(int(card_id))
+            return groups
+        for group in value.split(';'):
+            category_id, ids = group.split(':')
+            groups[int(category_id)] = array(WORD, map(int, ids.split(','))) if ids else array(WORD)
+        return groups
+
+    @classmethod
+    def _load(cls, value: Union[bytes, memoryview, str, None]) -> Dict[int, Sequence[int]]:
+        if not value:
+            return {}
+        if isinstance(value, str):
+            return cls._load_text(value)
+        if bytes(value[:len(BINARY_MAGIC)]) != BINARY_MAGIC:
+            return cls._load_text(bytes(value).decode())
+        return cls._load_binary(value)
+
+    # Значение для колонки Game.deck
+    def dump_deck(self) -> bytes:
+        return self._dump(self.queues)
+
+    # Значение для колонки Game.initial_deck
+    def dump_initial_deck(self) -> bytes:
+        return self._dump(self.pools)
+
+    @classmethod
+    def loads(cls, deck: Union[bytes, memoryview, str, None], initial_deck: Union[bytes, memoryview, str, None],
+              seed: int = 0) -> "Deck":
+        return cls(cls._load(deck), cls._load(initial_deck), seed)
+
+
+# Приведение сохраненной колоды к двоичному формату (текстовые колоды преобразуются).
+# Значение в двоичном формате возвращается как есть, без копирования
+def to_binary(value: Union[bytes, memoryview, str, None]) -> Union[bytes, memoryview, None]:
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)) and bytes(value[:len(BINARY_MAGIC)]) == BINARY_MAGIC:
+        return value
+    return Deck._dump(Deck._load(value))
@@ -0,0 +1,33 @@
+import hashlib
+from typing import Callable, Optional
+
+from fastapi import HTTPException, Request, Response
+
+from app.store import GameStore
+
+
+# Сильный ETag ответа: хеш пути, параметров запроса и версий таблиц, из которых строится ответ
+def make_etag(request: Request, versions: dict) -> str:
+    key = f'{request.url.path}?{request.url.query}|{sorted(versions.items())}'
+    return f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+
+# Совпадает ли ETag с одним из значений заголовка If-None-Match
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+# Зависимость FastAPI для условных GET-запросов к данным таблиц tables.
+# Если ETag клиента актуален, возвращается 304 без обращения к базе данных, иначе ETag добавляется в ответ.
+# Версии читаются до запроса к базе данных, поэтому ответ не может получить ETag более новой версии данных
+def conditional_get(store: GameStore, *tables: str) -> Callable:
+    async def dependency(request: Request, response: Response):
+        etag = make_etag(request, await store.get_versions(tables))
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+
+    return dependency
@@ -0,0 +1,75 @@
+import asyncio
+import json
+from typing import Dict, Optional, Set
+
+
+# Подписка на события игры с ограниченной очередью. None в очереди - конец потока событий
+class Subscription:
+    def __init__(self, game_id: int, queue_size: int):
+        self.game_id = game_id
+        self.queue: "asyncio.Queue[Optional[dict]]" = asyncio.Queue(queue_size + 2)
+        self.queue_size = queue_size
+        self.closed = False
+
+    # Добавление события. False - подписчик не успевает забирать события
+    def _push(self, event: dict) -> bool:
+        if self.queue.qsize() >= self.queue_size:
+            return False
+        self.queue.put_nowait(event)
+        return True
+
+    # Завершение потока событий. Если подписчик отстал, его очередь очищается,
+    # а последним событием он получает lagged и должен заново запросить состояние игры
+    def _close(self, lagged: bool = False):
+        if self.closed:
+            return
+        self.closed = True
+        if lagged:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "lagged", "game_id": self.game_id})
+        self.queue.put_nowait(None)
+
+    # Следующее событие, None - поток событий завершен. asyncio.TimeoutError - событий не было timeout секунд
+    async def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+# Рассылка событий игр (started, card_drawn, finished) подписчикам в пределах воркера.
+# publish не ждет подписчиков: медленный подписчик с заполненной очередью отключается
+class GameEvents:
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.subscribers: Dict[int, Set[Subscription]] = {}
+
+    def subscribe(self, game_id: int) -> Subscription:
+        subscription = Subscription(game_id, self.queue_size)
+        self.subscribers.setdefault(game_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self.subscribers.get(subscription.game_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self.subscribers[subscription.game_id]
+
+    def publish(self, game_id: int, event_type: str, **data):
+        event = {"type": event_type, "game_id": game_id, **data}
+        for subscription in list(self.subscribers.get(game_id, ())):
+            if not subscription._push(event):
+                subscription._close(lagged=True)
+                self.unsubscribe(subscription)
+
+    # Завершение всех потоков событий (при остановке приложения)
+    def close(self):
+        for subscribers in list(self.subscribers.values()):
+            for subscription in subscribers:
+                subscription._close()
+        self.subscribers.clear()
+
+
+# Событие в формате Server-Sent Events
+def format_sse(event: dict) -> bytes:
+    return f'event: {event["type"]}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n'.encode()
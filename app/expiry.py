@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud import expire_games
+
+logger = logging.getLogger(__name__)
+
+
+# Фоновый сброс запущенных игр, которые идут дольше max_duration секунд.
+# Раз в interval секунд игры сбрасываются одним запросом, затем on_expired освобождает их состояние
+class GameExpiry:
+    def __init__(self, session_factory: Callable[[], AsyncSession], on_expired: Callable[[List[int]], Awaitable],
+                 interval: float, max_duration: float):
+        self.session_factory = session_factory
+        self.on_expired = on_expired
+        self.interval = interval
+        self.max_duration = max_duration
+        self._task: Optional[asyncio.Task] = None
+
+    def cutoff(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=self.max_duration)
+
+    # Сброс игр с истекшим сроком. Возвращает число сброшенных игр
+    async def expire(self) -> int:
+        async with self.session_factory() as db:
+            game_ids = await expire_games(db, self.cutoff())
+        if game_ids:
+            await self.on_expired(game_ids)
+            logger.info("Expired %d stale games: %s", len(game_ids), game_ids)
+        return len(game_ids)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.expire()
+            except Exception:
+                logger.exception("Failed to expire stale games")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,36 @@
+import json
+from typing import AsyncIterator, Callable
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud import normalize_hashtags
+from app.models import Card, Category, Set, SetCardAssociation
+
+# Записи выгрузки каталога в порядке зависимостей: тип записи и запрос.
+# Тот же порядок ожидает импорт каталога
+CATALOG_RECORDS = [
+    ("category", select(Category.id, Category.name, Category.color).order_by(Category.id)),
+    ("set", select(Set.id, Set.name, Set.category_id).order_by(Set.id)),
+    ("card", select(Card.id, Card.number, Card.description, Card.hashtags, Card.category_id).order_by(Card.id)),
+    ("set_card", select(SetCardAssociation.set_id, SetCardAssociation.card_id)),
+]
+
+
+def _record(record_type: str, row) -> dict:
+    data = {"type": record_type, **row._asdict()}
+    if record_type == "card":
+        data["hashtags"] = normalize_hashtags((data["hashtags"] or "").split(","))
+    return data
+
+
+# Выгрузка каталога в NDJSON. Строки читаются курсором частями по chunk_size,
+# поэтому память не зависит от размера каталога. Сессия открывается на время выгрузки
+async def export_catalog(session_factory: Callable[[], AsyncSession], chunk_size: int) -> AsyncIterator[bytes]:
+    async with session_factory() as db:
+        for record_type, statement in CATALOG_RECORDS:
+            result = await db.stream(statement.execution_options(yield_per=chunk_size))
+            async for rows in result.partitions():
+                yield "".join(
+                    json.dumps(_record(record_type, row), ensure_ascii=False) + "\n" for row in rows
+                ).encode()
@@ -0,0 +1,430 @@
+import codecs
+import csv
+import json
+from collections import Counter
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud import get_or_create_hashtag_ids, normalize_hashtags, raise_card_seq, reserve_card_numbers
+from app.models import Card, CardHashtagAssociation, Category, Hashtag, Set, SetCardAssociation
+from app.schemas import CardImport
+
+# Форматы массового импорта
+IMPORT_FORMATS = ("csv", "jsonl")
+
+
+# Построчное чтение потока байтов без загрузки всего тела запроса в память
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+# Разбор JSONL: по одному объекту карточки в строке.
+# Возвращает (номер строки, данные строки, ошибка)
+async def parse_jsonl(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    row = 0
+    async for line in lines:
+        row += 1
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield row, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(data, dict):
+            yield row, None, "Row must be a JSON object"
+            continue
+        yield row, data, None
+
+
+# Разбор CSV с заголовком category_id,description,hashtags.
+# Хештеги перечисляются через запятую в одном поле, каждая запись занимает одну строку
+async def parse_csv(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    header = None
+    row = 0
+    async for line in lines:
+        row += 1
+        if not line.strip():
+            continue
+        try:
+            values = next(csv.reader([line]))
+        except csv.Error as e:
+            yield row, None, f"Invalid CSV: {e}"
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield row, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        data = dict(zip(header, values))
+        if "hashtags" in data:
+            data["hashtags"] = [h.strip() for h in data["hashtags"].split(",")]
+        yield row, data, None
+
+
+# Добавление карточек пачками: каждая пачка - одна транзакция.
+# Ошибки отдельных строк собираются и не прерывают импорт остальных строк.
+# Если пачка не добавилась, ее строки добавляются по одной, чтобы найти строки с ошибкой
+class CardImporter:
+    def __init__(self, db: AsyncSession, batch_size: int):
+        self.db = db
+        self.batch_size = batch_size
+        self.batch: List[Tuple[int, CardImport]] = []
+        self.imported = 0
+        self.errors: List[dict] = []
+        # id категории -> id основного набора, None - категории не существует
+        self.main_sets: Dict[int, Optional[int]] = {}
+
+    def error(self, row: int, message: str):
+        self.errors.append({"row": row, "error": message})
+
+    async def add(self, row: int, data: dict):
+        try:
+            card = CardImport.model_validate(data)
+        except ValidationError as e:
+            self.error(row, "; ".join(f'{".".join(map(str, err["loc"]))}: {err["msg"]}' for err in e.errors()))
+            return
+        self.batch.append((row, card))
+        if len(self.batch) >= self.batch_size:
+            await self.flush()
+
+    # Загрузка основных наборов для новых категорий пачки
+    async def _load_categories(self, category_ids):
+        new_ids = set(category_ids) - self.main_sets.keys()
+        if not new_ids:
+            return
+        categories = dict((await self.db.execute(
+            select(Category.id, Category.name).where(Category.id.in_(new_ids)))).all())
+        main_sets = dict((await self.db.execute(
+            select(Set.category_id, func.min(Set.id))
+            .where(Set.category_id.in_(categories.keys()), Set.name.startswith("Main Set"))
+            .group_by(Set.category_id))).all())
+        for category_id in new_ids:
+            if category_id not in categories:
+                self.main_sets[category_id] = None
+                continue
+            if category_id not in main_sets:
+                main_sets[category_id] = await self.db.scalar(
+                    insert(Set).values(name=f'Main Set ({categories[category_id]})', category_id=category_id)
+                    .returning(Set.id))
+            self.main_sets[category_id] = main_sets[category_id]
+
+    async def flush(self):
+        batch, self.batch = self.batch, []
+        if batch:
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[int, CardImport]]):
+        main_sets = dict(self.main_sets)
+        errors = len(self.errors)
+        try:
+            await self._load_categories(card.category_id for _, card in batch)
+            rows = []
+            for row, card in batch:
+                if self.main_sets[card.category_id] is None:
+                    self.error(row, "Category not found")
+                    continue
+                rows.append((row, card))
+            if rows:
+                await self._insert(rows)
+            await self.db.commit()
+            self.imported += len(rows)
+        except Exception as e:
+            # Пачка не добавлена целиком, состояние категорий и ошибки возвращаются к началу пачки
+            await self.db.rollback()
+            self.main_sets = main_sets
+            del self.errors[errors:]
+            if len(batch) == 1:
+                self.error(batch[0][0], f"Row failed: {e}")
+                return
+            # Ошибка базы данных в одной строке (например, одновременное создание того же хештега)
+            # не отменяет остальные: строки пачки добавляются по одной
+            for item in batch:
+                await self._flush([item])
+
+    async def _insert(self, rows: List[Tuple[int, CardImport]]):
+        hashtags = [normalize_hashtags(card.hashtags) for _, card in rows]
+        hashtag_ids = await get_or_create_hashtag_ids(self.db, (h for names in hashtags for h in names))
+        # Номера карточек выделяются одним UPDATE счетчика на категорию пачки
+        numbers = {}
+        for category_id, count in Counter(card.category_id for _, card in rows).items():
+            numbers[category_id] = await reserve_card_numbers(self.db, category_id, count)
+        values = []
+        for _, card in rows:
+            values.append({
+                "number": numbers[card.category_id],
+                "description": card.description,
+                "hashtags": ",".join(card.hashtags),
+                "category_id": card.category_id,
+            })
+            numbers[card.category_id] += 1
+        card_ids = (await self.db.scalars(insert(Card).returning(Card.id, sort_by_parameter_order=True), values)).all()
+        # Добавление карточек в основные наборы категорий
+        await self.db.execute(insert(SetCardAssociation), [
+            {"set_id": self.main_sets[card.category_id], "card_id": card_id}
+            for (_, card), card_id in zip(rows, card_ids)
+        ])
+        links = [{"card_id": card_id, "hashtag_id": hashtag_ids[h]}
+                 for card_id, names in zip(card_ids, hashtags) for h in names]
+        if links:
+            await self.db.execute(insert(CardHashtagAssociation), links)
+            counts = Counter(link["hashtag_id"] for link in links)
+            await self.db.execute(
+                update(Hashtag.__table__)
+                .where(Hashtag.__table__.c.id == bindparam("hashtag_id"))
+                .values(card_count=Hashtag.__table__.c.card_count + bindparam("added")),
+                [{"hashtag_id": hashtag_id, "added": added} for hashtag_id, added in counts.items()]
+            )
+
+    def result(self) -> dict:
+        return {"imported": self.imported, "errors": sorted(self.errors, key=lambda e: e["row"])}
+
+
+# Импорт карточек из потока CSV или JSONL. default_category_id подставляется в строки без category_id
+async def import_cards(db: AsyncSession, chunks: AsyncIterator[bytes], fmt: str, batch_size: int,
+                       default_category_id: Optional[int] = None) -> dict:
+    parse = parse_csv if fmt == "csv" else parse_jsonl
+    importer = CardImporter(db, batch_size)
+    async for row, data, error in parse(iter_lines(chunks)):
+        if error is not None:
+            importer.error(row, error)
+            continue
+        if default_category_id is not None and not data.get("category_id"):
+            data["category_id"] = default_category_id
+        await importer.add(row, data)
+    await importer.flush()
+    return importer.result()
+
+
+# Импорт каталога из выгрузки export_catalog: категории, наборы, карточки и их связи.
+# id из выгрузки сопоставляются с новыми id. Категории и наборы с уже существующими названиями
+# используются повторно, как и карточки существующих категорий с теми же номером и описанием,
+# поэтому повторный импорт выгрузки в ту же базу данных ничего не дублирует
+class CatalogImporter:
+    def __init__(self, db: AsyncSession, batch_size: int):
+        self.db = db
+        self.batch_size = batch_size
+        self.batch_type: Optional[str] = None
+        self.batch: List[Tuple[int, dict]] = []
+        self.imported: Counter = Counter()
+        self.errors: List[dict] = []
+        # id из выгрузки -> новый id
+        self.categories: Dict[int, int] = {}
+        self.sets: Dict[int, int] = {}
+        self.cards: Dict[int, int] = {}
+        # Созданные импортом категории сохраняют номера карточек из выгрузки
+        self.created_categories: set = set()
+        self.handlers = {
+            "category": self._insert_categories,
+            "set": self._insert_sets,
+            "card": self._insert_cards,
+            "set_card": self._insert_set_cards,
+        }
+
+    def error(self, row: int, message: str):
+        self.errors.append({"row": row, "error": message})
+
+    async def add(self, row: int, data: dict):
+        record_type = data.get("type")
+        if record_type not in self.handlers:
+            self.error(row, f"Unknown record type: {record_type}")
+            return
+        if record_type != self.batch_type or len(self.batch) >= self.batch_size:
+            await self.flush()
+            self.batch_type = record_type
+        self.batch.append((row, data))
+
+    async def flush(self):
+        batch, self.batch = self.batch, []
+        if not batch:
+            return
+        # Состояние сопоставлений до пачки, восстанавливается при ошибке
+        saved = (dict(self.categories), dict(self.sets), dict(self.cards), set(self.created_categories))
+        errors = len(self.errors)
+        try:
+            imported = await self.handlers[self.batch_type](batch)
+            await self.db.commit()
+            self.imported[self.batch_type] += imported
+        except (KeyError, TypeError, ValueError) as e:
+            await self._fail(batch, saved, errors, f"Invalid record: {e}")
+        except Exception as e:
+            await self._fail(batch, saved, errors, f"Batch failed: {e}")
+
+    async def _fail(self, batch, saved, errors: int, message: str):
+        await self.db.rollback()
+        self.categories, self.sets, self.cards, self.created_categories = saved
+        del self.errors[errors:]
+        for row, _ in batch:
+            self.error(row, message)
+
+    async def _insert_categories(self, batch) -> int:
+        names = {data["name"] for _, data in batch}
+        existing = dict((await self.db.execute(
+            select(Category.name, Category.id).where(Category.name.in_(names)))).all())
+        new = {}
+        for _, data in batch:
+            if data["name"] not in existing and data["name"] not in new:
+                new[data["name"]] = data["color"]
+        if new:
+            result = await self.db.execute(
+                insert(Category).returning(Category.name, Category.id),
+                [{"name": name, "color": color} for name, color in new.items()]
+            )
+            created = dict(result.all())
+            existing.update(created)
+            self.created_categories.update(created.values())
+        for _, data in batch:
+            self.categories[int(data["id"])] = existing[data["name"]]
+        return len(batch)
+
+    async def _insert_sets(self, batch) -> int:
+        rows = []
+        for row, data in batch:
+            if int(data["category_id"]) not in self.categories:
+                self.error(row, "Category not found")
+                continue
+            rows.append(data)
+        names = {data["name"] for data in rows}
+        existing = dict((await self.db.execute(select(Set.name, Set.id).where(Set.name.in_(names)))).all())
+        new = {}
+        for data in rows:
+            if data["name"] not in existing and data["name"] not in new:
+                new[data["name"]] = self.categories[int(data["category_id"])]
+        if new:
+            result = await self.db.execute(
+                insert(Set).returning(Set.name, Set.id),
+                [{"name": name, "category_id": category_id} for name, category_id in new.items()]
+            )
+            existing.update(result.all())
+        for data in rows:
+            self.sets[int(data["id"])] = existing[data["name"]]
+        return len(rows)
+
+    async def _insert_cards(self, batch) -> int:
+        rows = []
+        for row, data in batch:
+            if int(data["category_id"]) not in self.categories:
+                self.error(row, "Category not found")
+                continue
+            rows.append(data)
+        matched = await self._match_cards(rows)
+        self.cards.update(matched)
+        new_rows = [data for data in rows if int(data["id"]) not in matched]
+        if new_rows:
+            await self._add_cards(new_rows)
+        return len(rows)
+
+    # Карточки выгрузки, которые уже есть в существующих категориях (повторный импорт в ту же базу данных):
+    # совпадают категория, номер и описание. Возвращает id из выгрузки -> id существующей карточки
+    async def _match_cards(self, rows) -> Dict[int, int]:
+        keys = {}
+        for data in rows:
+            category_id = self.categories[int(data["category_id"])]
+            if category_id not in self.created_categories and data.get("number") is not None:
+                keys[(category_id, int(data["number"]), data["description"])] = int(data["id"])
+        if not keys:
+            return {}
+        existing = await self.db.execute(
+            select(Card.id, Card.category_id, Card.number, Card.description)
+            .where(Card.category_id.in_({category_id for category_id, _, _ in keys}),
+                   Card.number.in_({number for _, number, _ in keys}))
+        )
+        matched = {}
+        for card_id, category_id, number, description in existing:
+            exported_id = keys.get((category_id, number, description))
+            if exported_id is not None:
+                matched.setdefault(exported_id, card_id)
+        return matched
+
+    async def _add_cards(self, rows):
+        # Существующие категории нумеруют карточки своими счетчиками, созданные - номерами из выгрузки
+        counts = Counter(self.categories[int(data["category_id"])] for data in rows)
+        numbers = {}
+        for category_id, count in counts.items():
+            if category_id not in self.created_categories:
+                numbers[category_id] = await reserve_card_numbers(self.db, category_id, count)
+        exported_numbers: Dict[int, int] = {}
+        hashtags = [normalize_hashtags(data.get("hashtags") or []) for data in rows]
+        hashtag_ids = await get_or_create_hashtag_ids(self.db, (h for names in hashtags for h in names))
+        values = []
+        for data in rows:
+            category_id = self.categories[int(data["category_id"])]
+            if category_id in self.created_categories:
+                number = data.get("number")
+                if number is not None:
+                    exported_numbers[category_id] = max(exported_numbers.get(category_id, 0), int(number))
+            else:
+                number = numbers[category_id]
+                numbers[category_id] += 1
+            values.append({
+                "number": number,
+                "description": data["description"],
+                "hashtags": ",".join(data.get("hashtags") or []),
+                "category_id": category_id,
+            })
+        card_ids = (await self.db.scalars(insert(Card).returning(Card.id, sort_by_parameter_order=True), values)).all()
+        for data, card_id in zip(rows, card_ids):
+            self.cards[int(data["id"])] = card_id
+        for category_id, number in exported_numbers.items():
+            await raise_card_seq(self.db, category_id, number)
+        links = [{"card_id": card_id, "hashtag_id": hashtag_ids[h]}
+                 for card_id, names in zip(card_ids, hashtags) for h in names]
+        if links:
+            await self.db.execute(insert(CardHashtagAssociation), links)
+            counts = Counter(link["hashtag_id"] for link in links)
+            await self.db.execute(
+                update(Hashtag.__table__)
+                .where(Hashtag.__table__.c.id == bindparam("hashtag_id"))
+                .values(card_count=Hashtag.__table__.c.card_count + bindparam("added")),
+                [{"hashtag_id": hashtag_id, "added": added} for hashtag_id, added in counts.items()]
+            )
+
+    # Уже существующие связи наборов с карточками пропускаются
+    async def _insert_set_cards(self, batch) -> int:
+        rows = {}
+        for row, data in batch:
+            set_id = self.sets.get(int(data["set_id"]))
+            card_id = self.cards.get(int(data["card_id"]))
+            if set_id is None or card_id is None:
+                self.error(row, "Set or card not found")
+                continue
+            rows[(set_id, card_id)] = row
+        if rows:
+            existing = await self.db.execute(
+                select(SetCardAssociation.set_id, SetCardAssociation.card_id)
+                .where(SetCardAssociation.set_id.in_({set_id for set_id, _ in rows}),
+                       SetCardAssociation.card_id.in_({card_id for _, card_id in rows}))
+            )
+            new = rows.keys() - {tuple(link) for link in existing}
+            if new:
+                await self.db.execute(insert(SetCardAssociation),
+                                      [{"set_id": set_id, "card_id": card_id} for set_id, card_id in new])
+        return len(rows)
+
+    def result(self) -> dict:
+        return {"imported": dict(self.imported), "errors": sorted(self.errors, key=lambda e: e["row"])}
+
+
+# Импорт каталога из потока NDJSON, полученного при выгрузке каталога
+async def import_catalog(db: AsyncSession, chunks: AsyncIterator[bytes], batch_size: int) -> dict:
+    importer = CatalogImporter(db, batch_size)
+    async for row, data, error in parse_jsonl(iter_lines(chunks)):
+        if error is not None:
+            importer.error(row, error)
+            continue
+        await importer.add(row, data)
+    await importer.flush()
+    return importer.result()
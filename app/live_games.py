@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import weakref
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.deck import Deck
+from app.models import Card, Category, Game, GameDraw
+from app.store import GameStore
+
+logger = logging.getLogger(__name__)
+
+
+# INSERT в журнал вытягиваний, пропускающий записи с уже существующим ключом
+def _insert_ignoring_conflicts(dialect_name: str):
+    if dialect_name == "postgresql":
+        return postgresql.insert(GameDraw).on_conflict_do_nothing()
+    if dialect_name == "sqlite":
+        return sqlite.insert(GameDraw).on_conflict_do_nothing()
+    return insert(GameDraw).prefix_with("IGNORE", dialect="mysql")
+
+
+# Данные запущенной игры, нужные для ответа на вытягивание карточки, кешируются в памяти воркера.
+# Состояние колоды хранится в GameStore. seed - зерно колоды запуска игры, для которого загружены данные
+class LiveGame:
+    def __init__(self, game_id: int, seed: int, cards: Dict[int, Tuple[int, str]],
+                 categories: Dict[int, Tuple[str, str]]):
+        self.game_id = game_id
+        self.seed = seed
+        # id карточки -> (номер, описание)
+        self.cards = cards
+        # id категории -> (название, цвет)
+        self.categories = categories
+
+    def card_data(self, category_id: int, card_id: int) -> dict:
+        number, description = self.cards[card_id]
+        name, color = self.categories[category_id]
+        return {
+            "number": f'{category_id}.{number}',
+            "description": description,
+            "color": color,
+            "name": name
+        }
+
+
+# Реестр запущенных игр. Вытягивания выполняются в хранилище игр без обращения к базе данных,
+# а записи о них добавляются в журнал game_draws пачками: по таймеру или при накоплении max_pending вытягиваний.
+# Колода восстанавливается из колоды на момент запуска повторением вытягиваний из журнала.
+# Операции с одной игрой в воркере выполняются по очереди под блокировкой игры, разные игры не блокируют друг друга
+class LiveGameRegistry:
+    def __init__(self, store: GameStore, session_factory: Callable[[], AsyncSession], flush_interval: float,
+                 max_pending: int):
+        self.store = store
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.games: Dict[int, LiveGame] = {}
+        # Блокировки игр, удаляются, когда их никто не использует
+        self.locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+        # Несохраненные записи журнала вытягиваний
+        self.draws: List[dict] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # Блокировка игры в воркере
+    def lock(self, game_id: int) -> asyncio.Lock:
+        lock = self.locks.get(game_id)
+        if lock is None:
+            lock = self.locks[game_id] = asyncio.Lock()
+        return lock
+
+    # Загрузка данных карточек и категорий игры из базы данных
+    async def _load(self, db: AsyncSession, game_id: int, deck: Deck) -> LiveGame:
+        card_ids = {card_id for pool in deck.pools.values() for card_id in pool}
+        cards = {
+            card_id: (number, description)
+            for card_id, number, description in
+            await db.execute(select(Card.id, Card.number, Card.description).where(Card.id.in_(card_ids)))
+        }
+        categories = {
+            category_id: (name, color)
+            for category_id, name, color in
+            await db.execute(select(Category.id, Category.name, Category.color)
+                             .where(Category.id.in_(deck.pools.keys())))
+        }
+        live_game = LiveGame(game_id, deck.seed, cards, categories)
+        self.games[game_id] = live_game
+        return live_game
+
+    # Запуск игры с новой колодой. Вызывается под lock(game_id), взятой до смены статуса игры.
+    # Колода с тем же seed, которую другой воркер успел восстановить из базы данных и из которой уже вытягивал,
+    # не перезаписывается. Колода прошлого запуска игры заменяется
+    async def start_game(self, db: AsyncSession, game_id: int, deck: Deck):
+        await self._load(db, game_id, deck)
+        if not await self.store.save_deck(game_id, deck, replace=False):
+            stored = await self.store.load_deck(game_id)
+            if stored is None or stored.seed != deck.seed:
+                await self.store.save_deck(game_id, deck)
+
+    # Загрузка запущенной игры из базы данных (например, после перезапуска или в другом воркере).
+    # restore_deck - колоды нет в хранилище, и ее нужно восстановить из таблицы games и журнала.
+    # Колода, которую тем временем восстановил другой воркер, не перезаписывается
+    async def _restore(self, game_id: int, restore_deck: bool) -> Optional[LiveGame]:
+        if restore_deck:
+            await self.flush()
+        async with self.session_factory() as db:
+            game = await db.scalar(select(Game).where(Game.id == game_id, Game.status == "started"))
+            if not game:
+                return None
+            deck = Deck.loads(game.deck, game.initial_deck, game.seed)
+            if restore_deck:
+                deck.replay(await db.execute(
+                    select(GameDraw.seq, GameDraw.category_id, GameDraw.card_id)
+                    .where(GameDraw.game_id == game_id, GameDraw.seed == game.seed)
+                    .order_by(GameDraw.seq)
+                ))
+            live_game = await self._load(db, game_id, deck)
+        if restore_deck:
+            await self.store.save_deck(game_id, deck, replace=False)
+        return live_game
+
+    # Вытягивание карточки. None - игра не запущена, KeyError - категории нет в игре или в ней нет карточек
+    async def draw(self, game_id: int, category_id: int) -> Optional[dict]:
+        async with self.lock(game_id):
+            cards = await self._draw(game_id, [category_id])
+        return None if cards is None else cards[0]
+
+    # Пакетное вытягивание: по одной карточке из каждой категории списка одной операцией хранилища.
+    # Категории проверяются до вытягивания, поэтому при KeyError ни одна карточка не вытягивается
+    async def draw_many(self, game_id: int, category_ids: List[int]) -> Optional[List[dict]]:
+        async with self.lock(game_id):
+            return await self._draw(game_id, category_ids)
+
+    async def _store_draw(self, game_id: int, category_ids: List[int]) -> List[Optional[Tuple[int, int, int]]]:
+        if len(category_ids) == 1:
+            return [await self.store.draw(game_id, category_ids[0])]
+        return await self.store.draw_many(game_id, category_ids)
+
+    # Данные игры в памяти воркера могут относиться к прошлому запуску, если игру перезапустил другой воркер.
+    # Они загружаются заново, если в них нет запрошенной категории или вытягивание вернуло другое зерно колоды
+    async def _draw(self, game_id: int, category_ids: List[int]) -> Optional[List[dict]]:
+        live_game = self.games.get(game_id)
+        if live_game is None or not live_game.categories.keys() >= set(category_ids):
+            live_game = await self._restore(game_id, restore_deck=False)
+            if live_game is None:
+                return None
+        for category_id in category_ids:
+            if category_id not in live_game.categories:
+                raise KeyError(category_id)
+        try:
+            drawn = await self._store_draw(game_id, category_ids)
+        except KeyError:
+            live_game = await self._restore(game_id, restore_deck=True)
+            if live_game is None:
+                return None
+            drawn = await self._store_draw(game_id, category_ids)
+        if any(draw is not None and draw[0] != live_game.seed for draw in drawn):
+            live_game = await self._restore(game_id, restore_deck=False)
+            if live_game is None:
+                return None
+        cards = []
+        for category_id, draw in zip(category_ids, drawn):
+            if draw is None:
+                raise KeyError(category_id)
+            seed, seq, card_id = draw
+            self._log_draw(game_id, seed, seq, category_id, card_id)
+            cards.append(live_game.card_data(category_id, card_id))
+        return cards
+
+    # Добавление вытягивания в несохраненную часть журнала
+    def _log_draw(self, game_id: int, seed: int, seq: int, category_id: int, card_id: int):
+        self.draws.append({"game_id": game_id, "seed": seed, "seq": seq, "category_id": category_id,
+                           "card_id": card_id})
+        if len(self.draws) >= self.max_pending and self._wakeup is not None:
+            self._wakeup.set()
+
+    # Удаление игры из памяти и хранилища без сохранения вытягиваний
+    async def drop(self, game_id: int):
+        async with self.lock(game_id):
+            self.games.pop(game_id, None)
+            self.draws = [draw for draw in self.draws if draw["game_id"] != game_id]
+            await self.store.delete_deck(game_id)
+
+    # Запись журнала вытягиваний в базу данных одной транзакцией. Записи с уже занятым номером вытягивания
+    # (колоду восстановил другой воркер без них) пропускаются, не мешая записи остальных.
+    # При ошибке записи остаются несохраненными до следующей попытки
+    async def flush(self):
+        draws, self.draws = self.draws, []
+        if not draws:
+            return
+        try:
+            async with self.session_factory() as db:
+                await db.execute(_insert_ignoring_conflicts(db.bind.dialect.name), draws)
+                await db.commit()
+        except Exception:
+            self.draws[:0] = [draw for draw in draws if draw["game_id"] in self.games]
+            raise
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush live game decks")
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
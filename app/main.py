@@ -1,20 +1,72 @@
-from datetime import datetime, timedelta
-from typing import List
-import random
-
-from sqlalchemy.orm import Session
+import asyncio
+import secrets
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket
 from app.models import Admin, Host, Category, Set, Card, Game, Base, GameCategoryAssociation, SetCardAssociation, \
-    GameSetAssociation
-from app.database import SessionLocal, engine
+    GameSetAssociation, Hashtag, GameHashtagAssociation
+from app import config, crud
+from app.auth import TokenAuthorizer
+from app.etag import conditional_get
+from app.events import GameEvents, format_sse
+from app.expiry import GameExpiry
+from app.response_cache import ResponseCache
+from app.crud import change_game_status, expire_games, get_by_ids, get_deck_cards, get_hashtag_catalog, remove_cards, \
+    remove_category, remove_draws, remove_game, remove_sets, reserve_card_numbers, set_card_hashtags, set_game_hashtags
+from app.database import AsyncSessionLocal, async_engine, engine
+from app.deck import Deck
+from app.exporter import export_catalog
+from app.importer import IMPORT_FORMATS, import_cards, import_catalog
+from app.live_games import LiveGameRegistry
+from app.migrations import run_migrations, seed_admin
+from app.passwords import hash_password, verify_password
+from app.store import create_game_store
 from app.schemas import UserLogin, CategoryCreate, CardCreate, GameCreate, UserCreate, SetCreate, CardInSet, HostCreate, \
-    Card_add, SetEdit, CardEdit, GameEdit
-from app.utils import create_access_token, verify_access_token  # oauth2_scheme,
+    Card_add, SetEdit, CardEdit, GameEdit, CardDraw
+from app.utils import create_access_token, decode_access_token, get_token_id, get_token_ttl  # oauth2_scheme,
 from fastapi.security import OAuth2PasswordBearer
 
-app = FastAPI()
-blacklist = set()
+# Хранилище состояния игр и отозванных токенов
+store = create_game_store(config.GAME_STORE_URL, config.GAME_STATE_TTL)
+# События игр для подписчиков SSE и WebSocket этого воркера
+game_events = GameEvents(config.EVENT_QUEUE_SIZE)
+# Запущенные игры
+live_games = LiveGameRegistry(store, AsyncSessionLocal, config.DECK_FLUSH_INTERVAL, config.DECK_FLUSH_MAX_PENDING)
+
+
+# Освобождение состояния сброшенных по сроку игр
+async def release_expired_games(game_ids: List[int]):
+    for game_id in game_ids:
+        await live_games.drop(game_id)
+        game_events.publish(game_id, "finished")
+    await bump_versions("games")
+
+
+# Фоновый сброс игр, которые идут дольше GAME_MAX_DURATION
+game_expiry = GameExpiry(AsyncSessionLocal, release_expired_games, config.GAME_EXPIRY_INTERVAL,
+                         config.GAME_MAX_DURATION)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    live_games.start()
+    game_expiry.start()
+    yield
+    await game_expiry.stop()
+    game_events.close()
+    await live_games.stop()
+    await store.close()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 origins = [
     "*"
 ]
@@ -25,90 +77,119 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 # Инициализация базы данных
 Base.metadata.create_all(bind=engine)
+run_migrations(engine)
+seed_admin(engine, config.ADMIN_LOGIN, config.ADMIN_PASSWORD)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token", scheme_name="JWT")
+authorizer = TokenAuthorizer(store, oauth2_scheme, config.AUTH_CACHE_SIZE)
+# Зависимости для эндпоинтов админа и ведущего
+require_admin = authorizer.require("admin")
+require_host = authorizer.require("host")
+
+
+response_cache = ResponseCache(store, config.RESPONSE_CACHE_SIZE)
+
+
+# Размер страницы списка: limit=PAGE_SIZE по умолчанию, не больше MAX_PAGE_SIZE
+def page_size_query():
+    return Query(config.PAGE_SIZE, ge=1, le=config.MAX_PAGE_SIZE)
+
+
+# Курсор следующей страницы списка передается в заголовке X-Next-Cursor (значение для after_id),
+# тело ответа остается списком. Заголовка нет на последней странице
+def set_next_cursor(response: Response, next_cursor: Optional[int]):
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+
+
+# Увеличение версий изменившихся таблиц для ETag и кеша ответов, вызывается после commit
+async def bump_versions(*tables: str):
+    await store.bump_versions(tables)
 
 
 # Получение сессии базы данных
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+# Проверка пароля админа или ведущего. Хеш, созданный с другой стоимостью, пересчитывается
+async def check_password(db: AsyncSession, user, password: str):
+    valid, new_hash = await verify_password(password, user.password)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Incorrect password")
+    if new_hash is not None:
+        user.password = new_hash
+        await db.commit()
 
 
 # Вход админа
 @app.post("/admin/login")
-async def admin_login(admin: UserLogin, db: Session = Depends(get_db)):
-    adm = db.query(Admin).filter(Admin.login == admin.login).first()
-    if not (admin.login == "admin" and admin.password == "12345678"):
-        raise HTTPException(status_code=401, detail="Incorrect user")
+async def admin_login(admin: UserLogin, db: AsyncSession = Depends(get_db)):
+    adm = await db.scalar(select(Admin).where(Admin.login == admin.login))
     if not adm:
         raise HTTPException(status_code=401, detail="Incorrect user")
-    if admin.password != adm.password:
-        raise HTTPException(status_code=401, detail="Incorrect password")
+    await check_password(db, adm, admin.password)
 
     # Генерация JWT токена
-    while (access_token := create_access_token(data={"sub": adm.login})) in blacklist:
-        continue
+    access_token = create_access_token(data={"sub": adm.login, "role": "admin"})
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 # Вход ведущего
 @app.post("/host/login")
-async def register_admin(host: UserLogin, db: Session = Depends(get_db)):
-    h = db.query(Host).filter(Host.login == host.login).first()
+async def register_admin(host: UserLogin, db: AsyncSession = Depends(get_db)):
+    h = await db.scalar(select(Host).where(Host.login == host.login))
     if not h:
         raise HTTPException(status_code=401, detail="Incorrect user")
-    if h.password != host.password:
-        raise HTTPException(status_code=401, detail="Incorrect password")
+    await check_password(db, h, host.password)
 
     # Генерация JWT токена
-    while (access_token := create_access_token(data={"sub": h.login})) in blacklist:
-        continue
+    access_token = create_access_token(data={"sub": h.login, "role": "host"})
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 # Создание категории
 @app.post("/admin/createCategory")
-async def create_category(category: CategoryCreate, db: Session = Depends(get_db)):
+async def create_category(category: CategoryCreate, db: AsyncSession = Depends(get_db)):
     # Проверка на уникальность названия
-    existing_category = db.query(Category).filter(Category.name == category.name).first()
+    existing_category = await db.scalar(select(Category).where(Category.name == category.name))
     if existing_category:
         raise HTTPException(status_code=400, detail="Category name must be unique")
 
     # Создание
     new_category = Category(name=category.name, color=category.color)
     db.add(new_category)
-    db.commit()
-    db.refresh(new_category)
+    await db.commit()
+    await db.refresh(new_category)
 
     # Создание main_set для новой категории
     main_set = Set(name=f'Main Set ({category.name})', category_id=new_category.id)
     db.add(main_set)
-    db.commit()
-    db.refresh(main_set)
+    await db.commit()
+    await db.refresh(main_set)
 
+    await bump_versions("categories", "sets")
     return {"message": "Category created successfully!", "category_id": new_category.id}
 
 
 # Редактирование категории
 @app.post("/admin/editCategory")
-async def edit_category(category_id: int, category: CategoryCreate, db: Session = Depends(get_db)):
+async def edit_category(category_id: int, category: CategoryCreate, db: AsyncSession = Depends(get_db)):
     # Поиск категории по ID
-    db_category = db.query(Category).filter(Category.id == category_id).first()
+    db_category = await db.scalar(select(Category).where(Category.id == category_id))
 
     # Проверка, существует ли категория
     if not db_category:
         raise HTTPException(status_code=404, detail="Category not found")
 
     # Проверка на уникальность названия
-    existing_category = db.query(Category).filter(Category.name == category.name).first()
+    existing_category = await db.scalar(select(Category).where(Category.name == category.name))
     if existing_category and existing_category.id != category_id:
         raise HTTPException(status_code=400, detail="Category name must be unique")
 
@@ -117,51 +198,47 @@ async def edit_category(category_id: int, category: CategoryCreate, db: Session
     db_category.color = category.color
 
     # Применение изменений
-    db.commit()
-    db.refresh(db_category)
+    await db.commit()
+    await db.refresh(db_category)
 
+    await bump_versions("categories")
     return {"message": "Category updated successfully!", "category_id": db_category.id}
 
 
 # Данные о всех категориях
-@app.get("/admin/getCategories")
-async def get_categories(db: Session = Depends(get_db)):
-    # Получение всех категорий
-    categories = db.query(Category).all()
+@app.get("/admin/getCategories", dependencies=[Depends(conditional_get(store, "categories"))])
+async def get_categories(response: Response, after_id: Optional[int] = None, limit: int = page_size_query(),
+                         name_prefix: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    # Получение страницы категорий
+    categories, next_cursor = await crud.get_categories(db, after_id, limit, name_prefix)
+    set_next_cursor(response, next_cursor)
     return [{"id": category.id, "name": category.name, "color": category.color} for category in categories]
 
 
 #
 @app.post("/admin/deleteCategory")
-async def delete_category(category_id: int, db: Session = Depends(get_db)):
+async def delete_category(category_id: int, db: AsyncSession = Depends(get_db)):
     # Получаем категорию по id
-    category = db.query(Category).filter(Category.id == category_id).first()
+    category = await db.scalar(select(Category).where(Category.id == category_id))
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
 
-    # Удаляем все наборы, связанные с категорией
-    sets = db.query(Set).filter(Set.category_id == category_id).all()
-    for set_ in sets:
-        # Удаляем все карточки, связанные с набором через промежуточную таблицу
-        set_card_associations = db.query(SetCardAssociation).filter(SetCardAssociation.set_id == set_.id).all()
-        for association in set_card_associations:
-            db.delete(association)
-        # Удаляем набор
-        db.delete(set_)
-    cards = db.query(Card).filter(Card.category_id == category_id).all()
-    for card in cards:
-        db.delete(card)
-
-    # Удаляем категорию
-    db.delete(category)
-    db.commit()
+    # Удаляем наборы, карточки и связи категории с играми
+    await remove_category(db, category_id)
+    await db.commit()
 
+    await bump_versions("categories", "sets", "cards", "games")
     return {"message": "Category and all associated sets and cards deleted successfully!"}
 
 
-@app.get("/admin/getCategoryData")
-async def get_category_data(category_id: int, db: Session = Depends(get_db)):
-    category_data = db.query(Category).filter(category_id == Category.id).first()
+# Данные категории: карточки и наборы
+async def build_category_data(db: AsyncSession, category_id: int) -> dict:
+    # Карточки и наборы загружаются вместе с категорией, по одному запросу на связь
+    category_data = await db.scalar(
+        select(Category).where(category_id == Category.id)
+        .options(selectinload(Category.cards), selectinload(Category.sets)))
+    if not category_data:
+        raise HTTPException(status_code=404, detail="Category not found")
     cards = category_data.cards
     sets = category_data.sets
     card_data = []
@@ -182,83 +259,86 @@ async def get_category_data(category_id: int, db: Session = Depends(get_db)):
     return {"name": category_data.name, "color": category_data.color, "cards": card_data, "sets": set_data}
 
 
+@app.get("/admin/getCategoryData")
+async def get_category_data(category_id: int, db: AsyncSession = Depends(get_db)):
+    return await response_cache.get("getCategoryData", category_id, ("categories", "sets", "cards"),
+                                    lambda: build_category_data(db, category_id))
+
+
 # Функции для работы с наборами
 @app.post("/admin/addSetByCategoryID")
-async def addSetByCategoryID(set_data: SetCreate, db: Session = Depends(get_db)):
+async def addSetByCategoryID(set_data: SetCreate, db: AsyncSession = Depends(get_db)):
     # Проверка существования категории
-    category = db.query(Category).filter(Category.id == set_data.category_id).first()
+    category = await db.scalar(select(Category).where(Category.id == set_data.category_id))
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
 
     # Проверка на уникальность названия
-    existing_set = db.query(Set).filter(Set.name == set_data.name).first()
+    existing_set = await db.scalar(select(Set).where(Set.name == set_data.name))
     if existing_set:
         raise HTTPException(status_code=400, detail="Set name must be unique")
 
-    # Создание нового набора
-    new_set = Set(name=set_data.name, category_id=set_data.category_id)
-    db.add(new_set)
-    db.commit()
-    db.refresh(new_set)
-
-    # Добавление карточек в набор
+    # Карточки проверяются до сохранения, чтобы при ошибке набор не был создан
+    cards = await get_by_ids(db, Card, set_data.cards)
     for card_id in set_data.cards:
-        card = db.query(Card).filter(Card.id == card_id).first()
-        if not card:
+        if card_id not in cards:
             raise HTTPException(status_code=404, detail=f"Card with id {card_id} not found")
-        new_set.cards.append(card)
 
-    db.commit()
-    db.refresh(new_set)
+    # Создание нового набора вместе с карточками
+    new_set = Set(name=set_data.name, category_id=set_data.category_id)
+    new_set.cards = [cards[card_id] for card_id in dict.fromkeys(set_data.cards)]
+    db.add(new_set)
+    await db.commit()
+    await db.refresh(new_set)
 
+    await bump_versions("sets")
     return {"message": "Set created successfully!", "set_id": new_set.id}
 
 
 @app.post("/admin/editSetByID")
-async def edit_set_by_id(set_id: int, set: SetEdit, db: Session = Depends(get_db)):
-    db_set = db.query(Set).filter(Set.id == set_id).first()
+async def edit_set_by_id(set_id: int, set: SetEdit, db: AsyncSession = Depends(get_db)):
+    db_set = await db.scalar(select(Set).where(Set.id == set_id).options(selectinload(Set.cards)))
     if not db_set:
         raise HTTPException(status_code=404, detail="Set not found")
 
+    cards = await get_by_ids(db, Card, set.cards)
+    for card_id in set.cards:
+        if card_id not in cards:
+            raise HTTPException(status_code=404, detail=f"Card with id {card_id} not found")
     db_set.name = set.name
-    db_set.cards = [db.query(Card).filter(Card.id == card_id).first() for card_id in
-                    set.cards]
-    db.commit()
-    db.refresh(db_set)
+    db_set.cards = [cards[card_id] for card_id in dict.fromkeys(set.cards)]
+    await db.commit()
+    await db.refresh(db_set)
 
+    await bump_versions("sets")
     return {"message": "Set updated successfully!", "set_id": db_set.id}
 
 
 @app.post("/admin/deleteSetByID")
-async def delete_set(set_id: int, db: Session = Depends(get_db)):
-    db_set = db.query(Set).filter(Set.id == set_id).first()
+async def delete_set(set_id: int, db: AsyncSession = Depends(get_db)):
+    db_set = await db.scalar(select(Set).where(Set.id == set_id))
     if not db_set:
         raise HTTPException(status_code=404, detail="Set not found")
     if db_set.name.startswith("Main Set"):
         raise HTTPException(status_code=400, detail="You cannot delete the main set")
 
-    set_card_associations = db.query(SetCardAssociation).filter(SetCardAssociation.set_id == set_id).all()
-    for association in set_card_associations:
-        db.delete(association)
-    # Удаление всех карточек, связанных с набором
-    for card in db_set.cards:
-        db.delete(card)
-
-    db.delete(db_set)
-    db.commit()
+    # Удаление всех карточек, связанных с набором, затем самого набора
+    card_ids = (await db.scalars(select(SetCardAssociation.card_id).where(SetCardAssociation.set_id == set_id))).all()
+    await remove_cards(db, card_ids)
+    await remove_sets(db, [set_id])
+    await db.commit()
 
+    await bump_versions("sets", "cards", "games")
     return {"message": "Set deleted successfully!"}
 
 
 @app.post("/admin/getSetInfo")
-async def get_set_info(set_id: int, db: Session = Depends(get_db)):
-    set_info = db.query(Set).filter(Set.id == set_id).first()
+async def get_set_info(set_id: int, db: AsyncSession = Depends(get_db)):
+    # Карточки набора загружаются одним запросом через промежуточную таблицу SetCardAssociation
+    set_info = await db.scalar(select(Set).where(Set.id == set_id).options(selectinload(Set.cards)))
     if not set_info:
         raise HTTPException(status_code=404, detail="Set not found")
-
-    # Получаем карточки через промежуточную таблицу SetCardAssociation
-    set_card_associations = db.query(SetCardAssociation).filter(SetCardAssociation.set_id == set_id).all()
-    cards = [db.query(Card).filter(Card.id == association.card_id).first() for association in set_card_associations]
+    cards = set_info.cards
 
     set_data = {
         "name": set_info.name,
@@ -271,68 +351,95 @@ async def get_set_info(set_id: int, db: Session = Depends(get_db)):
 
 # Функции для работы с карточками
 @app.post("/admin/addCardByCategoryID")
-async def add_card_by_category_id(card: Card_add, db: Session = Depends(get_db)):
-    category = db.query(Category).filter(Category.id == card.category_id).first()
+async def add_card_by_category_id(card: Card_add, db: AsyncSession = Depends(get_db)):
+    category = await db.scalar(select(Category).where(Category.id == card.category_id))
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
 
-    main_set = db.query(Set).filter(Set.category_id == card.category_id, Set.name.startswith("Main Set")).first()
+    main_set = await db.scalar(select(Set).where(Set.category_id == card.category_id, Set.name.startswith("Main Set")))
     if not main_set:
         main_set = Set(name="Main Set", category_id=card.category_id)
         db.add(main_set)
-        db.commit()
-        db.refresh(main_set)
+        await db.flush()
 
     new_card = Card(
-        number=len(category.cards) + 1,
+        number=await reserve_card_numbers(db, card.category_id),
         description=card.description,
-        hashtags=",".join(card.hashtags),
         category_id=card.category_id
     )
+    await set_card_hashtags(db, new_card, card.hashtags)
     db.add(new_card)
-    db.commit()
-    db.refresh(new_card)
+    await db.flush()
 
-    # Добавление карточки в main_set
-    main_set.cards.append(new_card)
-    db.commit()
+    # Добавление карточки в main_set строкой связи, без загрузки остальных карточек набора.
+    # Номер, карточка и связь сохраняются одной транзакцией
+    db.add(SetCardAssociation(set_id=main_set.id, card_id=new_card.id))
+    await db.commit()
 
+    await bump_versions("cards", "sets")
     return {"message": "Card added successfully!", "card_id": new_card.id}
 
 
+# Массовый импорт карточек из CSV или JSONL. Тело запроса разбирается по мере получения,
+# карточки добавляются пачками, ошибки возвращаются по номерам строк. Строки пачки, которую не удалось
+# сохранить, добавляются по одной, поэтому ошибка одной строки не отменяет остальные
+@app.post("/admin/importCards")
+async def import_cards_by_stream(request: Request, format: str = "jsonl", category_id: Optional[int] = None,
+                                 db: AsyncSession = Depends(get_db)):
+    if format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of: {', '.join(IMPORT_FORMATS)}")
+    result = await import_cards(db, request.stream(), format, config.IMPORT_BATCH_SIZE, category_id)
+    await bump_versions("cards", "sets")
+    return result
+
+
+# Выгрузка каталога (категории, наборы, карточки и их связи) в NDJSON потоком
+@app.get("/admin/exportCatalog")
+async def export_catalog_stream():
+    return StreamingResponse(export_catalog(AsyncSessionLocal, config.EXPORT_CHUNK_SIZE),
+                             media_type="application/x-ndjson")
+
+
+# Импорт каталога из выгрузки /admin/exportCatalog. Повторный импорт той же выгрузки ничего не дублирует
+@app.post("/admin/importCatalog")
+async def import_catalog_stream(request: Request, db: AsyncSession = Depends(get_db)):
+    result = await import_catalog(db, request.stream(), config.IMPORT_BATCH_SIZE)
+    await bump_versions("categories", "sets", "cards")
+    return result
+
+
 @app.post("/admin/editCardByID")
-async def edit_card_by_id(card_id: int, card: CardEdit, db: Session = Depends(get_db)):
-    db_card = db.query(Card).filter(Card.id == card_id).first()
+async def edit_card_by_id(card_id: int, card: CardEdit, db: AsyncSession = Depends(get_db)):
+    db_card = await db.scalar(select(Card).where(Card.id == card_id))
     if not db_card:
         raise HTTPException(status_code=404, detail="Card not found")
 
     db_card.description = card.description
-    db_card.hashtags = ",".join(card.hashtags)
-    db.commit()
-    db.refresh(db_card)
+    await set_card_hashtags(db, db_card, card.hashtags)
+    await db.commit()
+    await db.refresh(db_card)
 
+    await bump_versions("cards")
     return {"message": "Card updated successfully!"}
 
 
 @app.post("/admin/deleteCard")
-async def delete_card(card_id: int, db: Session = Depends(get_db)):
-    card = db.query(Card).filter(Card.id == card_id).first()
+async def delete_card(card_id: int, db: AsyncSession = Depends(get_db)):
+    card = await db.scalar(select(Card).where(Card.id == card_id))
     if not card:
         raise HTTPException(status_code=404, detail="Card not found")
 
-    # Удаление карточки из всех наборов
-    for set_ in card.sets:
-        set_.cards.remove(card)
-
-    db.delete(card)
-    db.commit()
+    # Удаление карточки вместе со связями с наборами и хештегами
+    await remove_cards(db, [card_id])
+    await db.commit()
 
+    await bump_versions("cards", "sets")
     return {"message": "Card deleted successfully!"}
 
 
 @app.post("/admin/getCardInfo")
-async def get_card_info(card_id: int, db: Session = Depends(get_db)):
-    card_info = db.query(Card).filter(Card.id == card_id).first()
+async def get_card_info(card_id: int, db: AsyncSession = Depends(get_db)):
+    card_info = await db.scalar(select(Card).where(Card.id == card_id))
     if not card_info:
         raise HTTPException(status_code=404, detail="Card not found")
 
@@ -346,116 +453,125 @@ async def get_card_info(card_id: int, db: Session = Depends(get_db)):
 
 # Функции для работы с ведущими
 @app.post("/admin/createHost")
-async def create_host(host: UserCreate, db: Session = Depends(get_db)):
-    new_host = Host(login=host.login, password=host.password)
+async def create_host(host: UserCreate, db: AsyncSession = Depends(get_db)):
+    new_host = Host(login=host.login, password=await hash_password(host.password))
     db.add(new_host)
-    db.commit()
-    db.refresh(new_host)
+    await db.commit()
+    await db.refresh(new_host)
+    await bump_versions("hosts")
     return {"message": "Host created successfully!", "host_id": new_host.id}
 
 
-@app.get("/admin/getHosts")
-async def get_hosts(db: Session = Depends(get_db)):
-    hosts = db.query(Host).all()
-    return [{"id": host.id, "login": host.login, "password": host.password} for host in hosts]
+@app.get("/admin/getHosts", dependencies=[Depends(conditional_get(store, "hosts"))])
+async def get_hosts(response: Response, after_id: Optional[int] = None, limit: int = page_size_query(),
+                    login_prefix: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    hosts, next_cursor = await crud.get_hosts(db, after_id, limit, login_prefix)
+    set_next_cursor(response, next_cursor)
+    # Пароли хранятся только в виде хешей и не возвращаются
+    return [{"id": host.id, "login": host.login} for host in hosts]
 
 
 @app.post("/admin/editHost")
-async def edit_host(host: HostCreate, db: Session = Depends(get_db)):
-    db_host = db.query(Host).filter(Host.id == host.id).first()
+async def edit_host(host: HostCreate, db: AsyncSession = Depends(get_db)):
+    db_host = await db.scalar(select(Host).where(Host.id == host.id))
     if not db_host:
         raise HTTPException(status_code=404, detail="Host not found")
 
     db_host.login = host.login
-    db_host.password = host.password
-    db.commit()
-    db.refresh(db_host)
+    db_host.password = await hash_password(host.password)
+    await db.commit()
+    await db.refresh(db_host)
 
+    await bump_versions("hosts")
     return {"message": "Host updated successfully!"}
 
 
 @app.post("/admin/deleteHostByID")
-async def delete_host_by_id(host_id: int, db: Session = Depends(get_db)):
-    db_host = db.query(Host).filter(Host.id == host_id).first()
+async def delete_host_by_id(host_id: int, db: AsyncSession = Depends(get_db)):
+    db_host = await db.scalar(select(Host).where(Host.id == host_id))
     if not db_host:
         raise HTTPException(status_code=404, detail="Host not found")
 
-    db.delete(db_host)
-    db.commit()
+    await db.delete(db_host)
+    await db.commit()
 
+    await bump_versions("hosts")
     return {"message": "Host deleted successfully!"}
 
 
 # Функции для работы с админами
 @app.get("/admin/logout")
 async def admin_logout(token: str):
-    blacklist.add(token)
+    # Токен отзывается до истечения срока его действия во всех воркерах
+    payload = decode_access_token(token, verify_exp=False)
+    await store.revoke_token(get_token_id(token, payload), get_token_ttl(payload))
+    authorizer.forget(token)
     return {"message": "Admin logged out successfully"}
 
 
 @app.post("/admin/checkAuth")
-async def check_auth_admin(token: str = Depends(oauth2_scheme)):
-    username = verify_access_token(token)
-    if username != "admin":
-        raise HTTPException(status_code=403, detail="Admin privileges required")
+async def check_auth_admin(payload: dict = Depends(require_admin)):
     return {"message": "Admin is authorized"}
 
 
 @app.post("/host/checkAuth")
-async def check_auth(token: str = Depends(oauth2_scheme)):
-    username = verify_access_token(token)
-    if username != "host":
-        raise HTTPException(status_code=403, detail="Host privileges required")
+async def check_auth(payload: dict = Depends(require_host)):
     return {"message": "Host is authorized"}
 
 
 # Эндпоинт для получения токена
 @app.post("/token")
-async def login(form_data: UserLogin, db: Session = Depends(get_db)):
+async def login(form_data: UserLogin, db: AsyncSession = Depends(get_db)):
     # Поиск пользователя в базе данных
-    adm = db.query(Admin).filter(Admin.login == form_data.login).first()
+    adm = await db.scalar(select(Admin).where(Admin.login == form_data.login))
 
     if not adm:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
+    await check_password(db, adm, form_data.password)
 
-    access_token = create_access_token(data={"sub": adm.login})
+    access_token = create_access_token(data={"sub": adm.login, "role": "admin"})
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+# Статистика кеша ответов
+@app.get("/admin/cacheStats")
+async def cache_stats():
+    return response_cache.stats()
+
+
 # Функции для работы с играми
 @app.post("/admin/new-game")
-async def new_game(game_data: GameCreate, db: Session = Depends(get_db)):
+async def new_game(game_data: GameCreate, db: AsyncSession = Depends(get_db)):
     new_game = Game(
         name=game_data.name,
         start_time=None,
         status="waiting",
         initial_deck=None,
-        deck=None,
-        hashtags=",".join(game_data.hashtags)
+        deck=None
     )
-    existing_game = db.query(Game).filter(Game.name == game_data.name).first()
+    existing_game = await db.scalar(select(Game).where(Game.name == game_data.name))
     if existing_game:
         raise HTTPException(status_code=400, detail="Game name must be unique")
-    # Добавление игры в базу данных
-    db.add(new_game)
-    db.commit()
-    db.refresh(new_game)
+    # Наборы и категории проверяются до сохранения, чтобы при ошибке игра не была создана
+    sets = await get_by_ids(db, Set, game_data.sets)
     for set_id in game_data.sets:
-        s = db.query(Set).filter(Set.id == set_id).first()
-        if not s:
+        if set_id not in sets:
             raise HTTPException(status_code=404, detail=f"Set with id {set_id} not found")
-        new_game.sets.append(s)
-
+    categories = await get_by_ids(db, Category, game_data.categories)
     for category_id in game_data.categories:
-        c = db.query(Category).filter(Category.id == category_id).first()
-        if not c:
+        if category_id not in categories:
             raise HTTPException(status_code=404, detail=f"Category with id {category_id} not found")
-        new_game.categories.append(c)
 
-    db.commit()
-    db.refresh(new_game)
+    # Добавление игры в базу данных
+    await set_game_hashtags(db, new_game, game_data.hashtags)
+    new_game.sets = [sets[set_id] for set_id in dict.fromkeys(game_data.sets)]
+    new_game.categories = [categories[category_id] for category_id in dict.fromkeys(game_data.categories)]
+    db.add(new_game)
+    await db.commit()
+    await db.refresh(new_game)
 
     # Возвращаем информацию о созданной игре
+    await bump_versions("games")
     return {
         "message": "Game created successfully!",
         "id": new_game.id
@@ -463,147 +579,200 @@ async def new_game(game_data: GameCreate, db: Session = Depends(get_db)):
 
 
 @app.post("/host/start-game/{game_id}")
-async def start_game(game_id: int, db: Session = Depends(get_db)):
-    game = db.query(Game).filter(Game.id == game_id).first()
+async def start_game(game_id: int, db: AsyncSession = Depends(get_db)):
+    game = await db.scalar(select(Game).where(Game.id == game_id))
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
 
     if game.status != "waiting":
         raise HTTPException(status_code=400, detail="Game is already started")
-    hashtags_game = game.hashtags.split(",")
-    deck = []
-    sets = game.sets
-    all_cards = set()
-    for set_ in sets:
-        set_card_associations = db.query(SetCardAssociation).filter(SetCardAssociation.set_id == set_.id).all()
-        for association in set_card_associations:
-            card = db.query(Card).filter(association.card_id == Card.id).first()
-            hashtags_card = card.hashtags.split(",")
-            # Проверка на принадлежность хештегов карты в хештегах игры
-            for h in hashtags_card:
-                if h in hashtags_game:
-                    all_cards.add(card.id)
-                    break
-    all_cards = list(all_cards)
-    for a_c_id in all_cards:
-        card = db.query(Card).filter(Card.id == a_c_id).first()
-        deck.append(f'{str(a_c_id)}.{card.category_id}')
-
-    random.shuffle(deck)
-
-    game.initial_deck = ','.join(deck)
-    game.deck = ','.join(deck)
-    game.status = "started"
-    game.start_time = datetime.utcnow()
-    db.commit()
-    db.refresh(game)
-
+    # Карточки из наборов игры с подходящими хештегами
+    cards = await get_deck_cards(db, game.id)
+    deck = Deck.build(cards, secrets.randbits(63))
+    await remove_draws(db, game.id)
+    # Вытягивание, пришедшее между сменой статуса и регистрацией колоды, ждет блокировку игры
+    # и получает новую колоду, а не восстанавливает ее из базы данных
+    async with live_games.lock(game.id):
+        # Игра запускается, только если ее не запустил параллельный запрос
+        if not await change_game_status(db, game.id, "waiting", "started", seed=deck.seed,
+                                        initial_deck=deck.dump_initial_deck(), deck=deck.dump_deck(),
+                                        start_time=datetime.utcnow()):
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="Game is already started")
+        await db.commit()
+        await live_games.start_game(db, game.id, deck)
+    await db.refresh(game)
+    game_events.publish(game.id, "started")
+
+    await bump_versions("games")
     return {"message": "Game started successfully!", "game_id": game.id}
 
 
 @app.post("/game/draw-card/{game_id}")
-async def draw_card(game_id: int, category_id: int, db: Session = Depends(get_db)):
-    game = db.query(Game).filter(Game.id == game_id).first()
-    category = db.query(Category).filter(Category.id == category_id).first()
-    if not game:
-        raise HTTPException(status_code=404, detail="Game not found")
-
-    if game.status != "started":
+async def draw_card(game_id: int, category_id: int, db: AsyncSession = Depends(get_db)):
+    try:
+        card_data = await live_games.draw(game_id, category_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="No cards in category")
+    if card_data is None:
+        if not await db.scalar(select(Game.id).where(Game.id == game_id)):
+            raise HTTPException(status_code=404, detail="Game not found")
         raise HTTPException(status_code=400, detail="Game is not started")
-    deck = game.deck.split(',')
-    found = False
-    if deck[0] == '' and len(deck) == 1:
-        deck = []
-    # Поиск карты из нужной категории
-    for d in deck:
-        card_id, categ_id = d.split('.')
-        if int(categ_id) == category_id:
-            found = True
-            break
-    # Заполнение недостающими картами из категории
-    if not found:
-        init_deck = game.initial_deck.split(',')
-        for i in init_deck:
-            card_id, categ_id = i.split('.')
-            if int(categ_id) == category_id:
-                deck.append(f'{card_id}.{categ_id}')
-    random.shuffle(deck)
-    c_id = 0
-    k = 0
-    # Получение id карточки
-    for d in deck:
-        k += 1
-        card_id, categ_id = d.split('.')
-        if int(categ_id) == category_id:
-            c_id = card_id
-            deck.pop(k - 1)
-            break
-    game.deck = ','.join(deck)
-    card = db.query(Card).filter(Card.id == c_id).first()
-    card_data = {
-        "number": f'{category_id}.{card.number}',
-        "description": card.description,
-        "color": category.color,
-        "name": category.name
-    }
-    db.commit()
-    db.refresh(game)
+    game_events.publish(game_id, "card_drawn", category_id=category_id, card=card_data)
     return card_data
 
 
+# Пакетное вытягивание (например, раздача в начале раунда): count карточек из каждой категории списка.
+# Все карточки вытягиваются одной операцией и возвращаются в порядке запроса
+@app.post("/game/draw-cards/{game_id}")
+async def draw_cards(game_id: int, draws: List[CardDraw], db: AsyncSession = Depends(get_db)):
+    # Размер пакета проверяется до построения списка категорий
+    if not 1 <= sum(draw.count for draw in draws) <= config.MAX_DRAW_BATCH:
+        raise HTTPException(status_code=400, detail=f"From 1 to {config.MAX_DRAW_BATCH} cards can be drawn at once")
+    category_ids = [draw.category_id for draw in draws for _ in range(draw.count)]
+    try:
+        cards = await live_games.draw_many(game_id, category_ids)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="No cards in category")
+    if cards is None:
+        if not await db.scalar(select(Game.id).where(Game.id == game_id)):
+            raise HTTPException(status_code=404, detail="Game not found")
+        raise HTTPException(status_code=400, detail="Game is not started")
+    for category_id, card_data in zip(category_ids, cards):
+        game_events.publish(game_id, "card_drawn", category_id=category_id, card=card_data)
+    return cards
+
+
 @app.post("/host/finish-game/{game_id}")
-async def finish_game(game_id: int, db: Session = Depends(get_db)):
-    game = db.query(Game).filter(Game.id == game_id).first()
+async def finish_game(game_id: int, db: AsyncSession = Depends(get_db)):
+    game = await db.scalar(select(Game).where(Game.id == game_id))
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
 
     if game.status != "started":
         raise HTTPException(status_code=400, detail="Game is not started")
-    game.deck = None
-    game.initial_deck = None
-    game.status = "waiting"
-    game.start_time = None
-    db.commit()
-    db.refresh(game)
+    if not await change_game_status(db, game_id, "started", "waiting", start_time=None, seed=None, deck=None,
+                                    initial_deck=None):
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Game is not started")
+    await remove_draws(db, game_id)
+    await db.commit()
+    # Состояние игры удаляется после смены статуса, чтобы параллельное вытягивание не загрузило его снова
+    await live_games.drop(game_id)
+    game_events.publish(game_id, "finished")
+
+    await bump_versions("games")
+    return {"message": "Game finished successfully!", "game_id": game_id}
+
+
+# Текущее состояние игры - первое событие подписки
+async def get_status_event(game_id: int) -> dict:
+    async with AsyncSessionLocal() as db:
+        status = await db.scalar(select(Game.status).where(Game.id == game_id))
+    if status is None:
+        raise HTTPException(status_code=404, detail="Game not found")
+    return {"type": "status", "game_id": game_id, "status": status}
+
+
+# Подписка на события игры через Server-Sent Events вместо опроса статуса игры.
+# Пока событий нет, раз в EVENT_KEEPALIVE_INTERVAL секунд отправляется комментарий, чтобы соединение не закрылось
+@app.get("/game/events/{game_id}")
+async def game_events_sse(game_id: int):
+    status_event = await get_status_event(game_id)
+    subscription = game_events.subscribe(game_id)
+
+    async def stream():
+        try:
+            yield format_sse(status_event)
+            while True:
+                try:
+                    event = await subscription.get(config.EVENT_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield format_sse(event)
+        finally:
+            game_events.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
-    return {"message": "Game finished successfully!", "game_id": game.id}
+
+# Подписка на события игры через WebSocket. События отправляются в формате JSON
+@app.websocket("/game/ws/{game_id}")
+async def game_events_websocket(websocket: WebSocket, game_id: int):
+    try:
+        status_event = await get_status_event(game_id)
+    except HTTPException:
+        await websocket.close(code=4404, reason="Game not found")
+        return
+    await websocket.accept()
+    subscription = game_events.subscribe(game_id)
+
+    # Ожидание отключения клиента, сообщения от клиента игнорируются
+    async def wait_disconnect():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    disconnected = asyncio.create_task(wait_disconnect())
+    try:
+        await websocket.send_json(status_event)
+        while True:
+            next_event = asyncio.create_task(subscription.get())
+            await asyncio.wait((next_event, disconnected), return_when=asyncio.FIRST_COMPLETED)
+            if not next_event.done():
+                next_event.cancel()
+                return
+            event = next_event.result()
+            if event is None:
+                break
+            await websocket.send_json(event)
+        await websocket.close()
+    finally:
+        disconnected.cancel()
+        game_events.unsubscribe(subscription)
 
 
 @app.get("/admin/check-game-status/{game_id}")
-async def check_game_status(game_id: int, db: Session = Depends(get_db)):
-    game = db.query(Game).filter(Game.id == game_id).first()
+async def check_game_status(game_id: int, db: AsyncSession = Depends(get_db)):
+    game = await db.scalar(select(Game).where(Game.id == game_id))
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
 
-    if game.status == "started" and game.start_time:
-        elapsed_time = datetime.utcnow() - game.start_time
-        if elapsed_time > timedelta(hours=12):
-            game.status = "waiting"
-            db.commit()
-            db.refresh(game)
+    # Игра могла истечь после последнего фонового сброса
+    if game.status == "started" and game.start_time and game.start_time < game_expiry.cutoff():
+        if await expire_games(db, game_expiry.cutoff(), game_id):
+            await release_expired_games([game_id])
+        await db.refresh(game)
     return {"game_id": game.id, "status": game.status}
 
 
-@app.get("/admin/getGames")
-async def admin_get_games(db: Session = Depends(get_db)):
-    games = db.query(Game).all()
+@app.get("/admin/getGames", dependencies=[Depends(conditional_get(store, "games"))])
+async def admin_get_games(response: Response, after_id: Optional[int] = None, limit: int = page_size_query(),
+                          status: Optional[str] = None, name_prefix: Optional[str] = None,
+                          db: AsyncSession = Depends(get_db)):
+    games, next_cursor = await crud.get_games(db, after_id, limit, status, name_prefix)
+    set_next_cursor(response, next_cursor)
     return [{"id": game.id, "name": game.name} for game in games]
 
 
-@app.get("/host/getGames")
-async def host_get_games(db: Session = Depends(get_db)):
-    games = db.query(Game).all()
+@app.get("/host/getGames", dependencies=[Depends(conditional_get(store, "games"))])
+async def host_get_games(response: Response, after_id: Optional[int] = None, limit: int = page_size_query(),
+                         status: Optional[str] = None, name_prefix: Optional[str] = None,
+                         db: AsyncSession = Depends(get_db)):
+    games, next_cursor = await crud.get_games(db, after_id, limit, status, name_prefix)
+    set_next_cursor(response, next_cursor)
     return [{"id": game.id, "name": game.name, "status": game.status} for game in games]
 
 
-@app.post("/host/getCategoriesByGameID")
-@app.post("/admin/getCategoriesByGameID")
-async def get_categories_by_game_id(game_id: int, db: Session = Depends(get_db)):
-    game = db.query(Game).filter(Game.id == game_id).first()
+# Категории игры
+async def build_game_categories(db: AsyncSession, game_id: int) -> dict:
+    # Категории игры загружаются вместе с игрой
+    game = await db.scalar(select(Game).where(Game.id == game_id).options(selectinload(Game.categories)))
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
 
-    # Получаем все категории, связанные с игрой
     categories = game.categories
 
     category_data = []
@@ -617,92 +786,111 @@ async def get_categories_by_game_id(game_id: int, db: Session = Depends(get_db))
     return {"game_id": game.id, "categories": category_data}
 
 
-@app.get("/admin/getgameInfo/{game_id}")
-async def get_game_info(game_id: int, db: Session = Depends(get_db)):
+@app.post("/host/getCategoriesByGameID")
+@app.post("/admin/getCategoriesByGameID")
+async def get_categories_by_game_id(game_id: int, db: AsyncSession = Depends(get_db)):
+    return await response_cache.get("getCategoriesByGameID", game_id, ("games", "categories"),
+                                    lambda: build_game_categories(db, game_id))
+
+
+# Данные игры для редактирования
+async def build_game_info(db: AsyncSession, game_id: int) -> dict:
     # название игры, список категорий с флагами, список сетов с флагами, хештеги с флагами
-    game = db.query(Game).filter(Game.id == game_id).first()
-    # Получение всех категорий в игре
-    categories_in_game = db.query(GameCategoryAssociation).filter(GameCategoryAssociation.game_id == game_id).all()
-    # Получение всех наборов в игре
-    sets_in_game = db.query(GameSetAssociation).filter(GameSetAssociation.game_id == game_id).all()
+    game = await db.scalar(select(Game).where(Game.id == game_id))
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
+    # Список id категорий в игре
+    id_category_list = set(await db.scalars(
+        select(GameCategoryAssociation.category_id).where(GameCategoryAssociation.game_id == game_id)))
     # Список id наборов в игре
-    id_set_list = [s.set_id for s in sets_in_game]
-    # Список id категорий  в игре
-    id_category_list = [categ.category_id for categ in categories_in_game]
-    # Получение всех категорий (которые вообще существуют)
-    all_categories = db.query(Category).all()
-    # Получение всех сетов (которые вообще существуют)
-    all_sets = db.query(Set).all()
-    id_all_sets = [s.id for s in all_sets]
+    id_set_list = set(await db.scalars(
+        select(GameSetAssociation.set_id).where(GameSetAssociation.game_id == game_id)))
+    # Все наборы (которые вообще существуют), сгруппированные по категориям
+    sets_by_category = {}
+    for s in await db.execute(select(Set.id, Set.name, Set.category_id)):
+        sets_by_category.setdefault(s.category_id, []).append({
+            "id": s.id,
+            "name": s.name,
+            "in_category": s.id in id_set_list
+        })
     game_data = dict()
     game_data["name"] = game.name
     category_data = []
-    for c in all_categories:
-        sets_in_category = db.query(Set).filter(Set.category_id == c.id).all()
-        sets_dict = []
-        for s in sets_in_category:
-            sets_dict.append({
-                "id": s.id,
-                "name": s.name,
-                "in_category": s.id in id_set_list
-            })
+    # Все категории (которые вообще существуют)
+    for c in await db.execute(select(Category.id, Category.name)):
         category_data.append({
             "id": c.id,
             "name": c.name,
             "in_game": c.id in id_category_list,
-            "sets": sets_dict
+            "sets": sets_by_category.get(c.id, [])
         })
     game_data["categories"] = category_data
-    list_of_all_hashtags = set()
+    # Хештеги из каталога хештегов
+    hashtags_in_game = set(await db.scalars(
+        select(Hashtag.name)
+        .join(GameHashtagAssociation, GameHashtagAssociation.hashtag_id == Hashtag.id)
+        .where(GameHashtagAssociation.game_id == game_id)))
     hash_list = []
-    for id_s in id_all_sets:
-        cards = db.query(SetCardAssociation).filter(SetCardAssociation.set_id == id_s).all()
-        for i in cards:
-            card = db.query(Card).filter(Card.id == i.card_id).first()
-            for h in card.hashtags.split(','):
-                list_of_all_hashtags.add(h)
-    for h in list_of_all_hashtags:
+    for h in await get_hashtag_catalog(db):
         hash_list.append({
             "name": h,
-            "in_game": h in game.hashtags.split(',')
+            "in_game": h in hashtags_in_game
         })
     game_data["hashtags"] = hash_list
     return game_data
 
 
+@app.get("/admin/getgameInfo/{game_id}")
+async def get_game_info(game_id: int, db: AsyncSession = Depends(get_db)):
+    return await response_cache.get("getgameInfo", game_id, ("games", "categories", "sets", "cards"),
+                                    lambda: build_game_info(db, game_id))
+
+
 @app.post("/admin/editGame/{game_id}")
-async def edit_game(game_id: int, game: GameEdit, db: Session = Depends(get_db)):
-    # Поиск игры по ID
-    db_game = db.query(Game).filter(Game.id == game_id).first()
+async def edit_game(game_id: int, game: GameEdit, db: AsyncSession = Depends(get_db)):
+    # Поиск игры по ID вместе с текущими связями, которые будут заменены
+    db_game = await db.scalar(
+        select(Game).where(Game.id == game_id)
+        .options(selectinload(Game.categories), selectinload(Game.sets), selectinload(Game.tags)))
     # Проверка, существует ли игра
     if not db_game:
         raise HTTPException(status_code=404, detail="Game not found")
     # Проверка на уникальность названия
-    existing_game = db.query(Game).filter(Game.name == game.name).first()
+    existing_game = await db.scalar(select(Game).where(Game.name == game.name))
     if existing_game and existing_game.id != game_id:
         raise HTTPException(status_code=400, detail="Game name must be unique")
+    categories = await get_by_ids(db, Category, game.categories)
+    for category_id in game.categories:
+        if category_id not in categories:
+            raise HTTPException(status_code=404, detail=f"Category with id {category_id} not found")
+    sets = await get_by_ids(db, Set, game.sets)
+    for set_id in game.sets:
+        if set_id not in sets:
+            raise HTTPException(status_code=404, detail=f"Set with id {set_id} not found")
     db_game.name = game.name
-    db_game.categories = [db.query(Category).filter(Category.id == category_id).first() for category_id in
-                          game.categories]
-    db_game.sets = [db.query(Set).filter(Set.id == set_id).first() for set_id in game.sets]
-    db_game.hashtags = ",".join(game.hashtags)
+    db_game.categories = [categories[category_id] for category_id in dict.fromkeys(game.categories)]
+    db_game.sets = [sets[set_id] for set_id in dict.fromkeys(game.sets)]
+    await set_game_hashtags(db, db_game, game.hashtags)
     # Применение изменений
-    db.commit()
-    db.refresh(db_game)
+    await db.commit()
+    await db.refresh(db_game)
+    await bump_versions("games")
     return {"message": "Game updated successfully!", "game_id": db_game.id}
 
 
 @app.post("/admin/deleteGameByID")
-async def delete_game(game_id: int, db: Session = Depends(get_db)):
+async def delete_game(game_id: int, db: AsyncSession = Depends(get_db)):
     # Поиск игры по ID
-    db_game = db.query(Game).filter(Game.id == game_id).first()
+    db_game = await db.scalar(select(Game).where(Game.id == game_id))
 
     # Проверка, существует ли игра
     if not db_game:
         raise HTTPException(status_code=404, detail="Game not found")
 
     # Удаление игры и всех связанных записей
-    db.delete(db_game)
-    db.commit()
+    await remove_game(db, game_id)
+    await db.commit()
+    await live_games.drop(game_id)
 
+    await bump_versions("games")
     return {"message": "Game deleted successfully!", "game_id": game_id}
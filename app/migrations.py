@@ -0,0 +1,184 @@
+import secrets
+from typing import Set, Tuple
+
+from sqlalchemy import LargeBinary, bindparam, exists, func, inspect, insert, select, text, update
+from sqlalchemy.engine import Engine
+
+from app.crud import normalize_hashtags
+from app.deck import to_binary
+from app.models import Admin, Base, Card, CardHashtagAssociation, Category, Game, GameHashtagAssociation, Hashtag, \
+    Host
+from app.passwords import executor, is_password_hash, make_password_hash
+
+
+# Добавление в существующие таблицы колонок, которые появились в моделях.
+# create_all создает только новые таблицы, поэтому новые колонки добавляются через ALTER TABLE.
+# Возвращает добавленные пары (таблица, колонка)
+def add_missing_columns(engine: Engine) -> Set[Tuple[str, str]]:
+    added = set()
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}'
+                if column.server_default is not None:
+                    if not column.nullable:
+                        ddl += ' NOT NULL'
+                    ddl += f' DEFAULT {column.server_default.arg}'
+                conn.execute(text(ddl))
+                added.add((table.name, column.name))
+    return added
+
+
+# Создание индексов моделей, которых нет в существующих таблицах (create_all создает индексы только новых таблиц)
+def create_missing_indexes(engine: Engine):
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+# Перенос хештегов из строк Card.hashtags и Game.hashtags в таблицу hashtags.
+# Обрабатываются только записи без связей с хештегами, поэтому миграцию можно запускать повторно.
+# Возвращает True, если были перенесены хештеги карточек
+def migrate_hashtags(engine: Engine) -> bool:
+    with engine.begin() as conn:
+        cards = conn.execute(
+            select(Card.id, Card.hashtags)
+            .where(Card.hashtags.isnot(None), Card.hashtags != "",
+                   ~exists().where(CardHashtagAssociation.card_id == Card.id))
+        ).all()
+        games = conn.execute(
+            select(Game.id, Game.hashtags)
+            .where(Game.hashtags.isnot(None), Game.hashtags != "",
+                   ~exists().where(GameHashtagAssociation.game_id == Game.id))
+        ).all()
+        cards = [(card_id, normalize_hashtags(hashtags.split(","))) for card_id, hashtags in cards]
+        games = [(game_id, normalize_hashtags(hashtags.split(","))) for game_id, hashtags in games]
+        names = {name for _, hashtags in cards + games for name in hashtags}
+        if not names:
+            return False
+
+        hashtag_ids = dict(conn.execute(select(Hashtag.name, Hashtag.id)).all())
+        missing = names - hashtag_ids.keys()
+        if missing:
+            conn.execute(insert(Hashtag), [{"name": name} for name in missing])
+            hashtag_ids = dict(conn.execute(select(Hashtag.name, Hashtag.id)).all())
+
+        card_rows = [{"card_id": card_id, "hashtag_id": hashtag_ids[name]}
+                     for card_id, hashtags in cards for name in hashtags]
+        if card_rows:
+            conn.execute(insert(CardHashtagAssociation), card_rows)
+        game_rows = [{"game_id": game_id, "hashtag_id": hashtag_ids[name]}
+                     for game_id, hashtags in games for name in hashtags]
+        if game_rows:
+            conn.execute(insert(GameHashtagAssociation), game_rows)
+    return bool(card_rows)
+
+
+# Пересчет числа карточек у всех хештегов
+def recount_hashtags(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(update(Hashtag).values(card_count=(
+            select(func.count())
+            .where(CardHashtagAssociation.hashtag_id == Hashtag.id)
+            .scalar_subquery()
+        )))
+
+
+# Хеширование паролей админов и ведущих, сохраненных открытым текстом.
+# Уже захешированные пароли не изменяются, поэтому миграцию можно запускать повторно
+def hash_plaintext_passwords(engine: Engine):
+    with engine.begin() as conn:
+        for model in (Admin, Host):
+            table = model.__table__
+            rows = [(user_id, password) for user_id, password in conn.execute(select(table.c.id, table.c.password))
+                    if password and not is_password_hash(password)]
+            if not rows:
+                continue
+            hashes = executor.map(make_password_hash, [password for _, password in rows])
+            conn.execute(
+                update(table).where(table.c.id == bindparam("user_id")).values(password=bindparam("password_hash")),
+                [{"user_id": user_id, "password_hash": password_hash}
+                 for (user_id, _), password_hash in zip(rows, hashes)]
+            )
+
+
+# Создание админа с заданными логином и паролем, если админа с таким логином нет
+def seed_admin(engine: Engine, login: str, password: str):
+    if not login or not password:
+        return
+    with engine.begin() as conn:
+        if conn.scalar(select(Admin.id).where(Admin.login == login)) is None:
+            conn.execute(insert(Admin).values(login=login, password=make_password_hash(password)))
+
+
+# Начальные значения счетчиков номеров карточек: наибольший номер карточки в категории
+def init_card_seq(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(update(Category).values(card_seq=(
+            select(func.coalesce(func.max(Card.number), 0))
+            .where(Card.category_id == Category.id)
+            .scalar_subquery()
+        )))
+
+
+# Перевод колод игр из текстового формата в двоичный. В PostgreSQL и MySQL тип колонок меняется
+# на двоичный (SQLite хранит в колонке значения любого типа), затем текстовые колоды перезаписываются.
+# Колоды в двоичном формате не изменяются, поэтому миграцию можно запускать повторно
+def migrate_deck_encoding(engine: Engine):
+    columns = ("deck", "initial_deck")
+    types = {column["name"]: column["type"] for column in inspect(engine).get_columns("games")}
+    with engine.begin() as conn:
+        for column in columns:
+            if isinstance(types[column], LargeBinary):
+                continue
+            if engine.dialect.name == "postgresql":
+                conn.execute(text(f"ALTER TABLE games ALTER COLUMN {column} TYPE bytea "
+                                  f"USING convert_to({column}, 'UTF8')"))
+            elif engine.dialect.name == "mysql":
+                conn.execute(text(f"ALTER TABLE games MODIFY {column} LONGBLOB"))
+
+        # Значения читаются без преобразования типом колонки, чтобы отличить текстовые колоды
+        rows = [
+            {"game_id": game_id, "deck": deck, "initial_deck": initial_deck}
+            for game_id, deck, initial_deck in conn.execute(
+                text("SELECT id, deck, initial_deck FROM games WHERE deck IS NOT NULL OR initial_deck IS NOT NULL")
+            )
+            if to_binary(deck) != deck or to_binary(initial_deck) != initial_deck
+        ]
+        if rows:
+            table = Game.__table__
+            conn.execute(
+                update(table).where(table.c.id == bindparam("game_id"))
+                .values(deck=bindparam("deck"), initial_deck=bindparam("initial_deck")),
+                rows
+            )
+
+
+# Зерна для игр, запущенных до появления журнала вытягиваний. Сохраненная колода таких игр
+# становится колодой на момент запуска, журнал для них пуст
+def init_game_seeds(engine: Engine):
+    with engine.begin() as conn:
+        game_ids = conn.scalars(select(Game.id).where(Game.status == "started", Game.seed.is_(None))).all()
+        if game_ids:
+            conn.execute(
+                update(Game.__table__).where(Game.__table__.c.id == bindparam("game_id")),
+                [{"game_id": game_id, "seed": secrets.randbits(63)} for game_id in game_ids]
+            )
+
+
+# Миграции схемы и данных, выполняются при запуске приложения после создания таблиц
+def run_migrations(engine: Engine):
+    added = add_missing_columns(engine)
+    create_missing_indexes(engine)
+    if ("categories", "card_seq") in added:
+        init_card_seq(engine)
+    if migrate_hashtags(engine) or ("hashtags", "card_count") in added:
+        recount_hashtags(engine)
+    hash_plaintext_passwords(engine)
+    migrate_deck_encoding(engine)
+    init_game_seeds(engine)
@@ -1,8 +1,26 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import BigInteger, Column, Integer, String, ForeignKey, DateTime, Index, LargeBinary
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.types import TypeDecorator
 
-Base = declarative_base()
+from app.deck import to_binary
+
+# AsyncAttrs позволяет загружать связи в асинхронной сессии: await obj.awaitable_attrs.<связь>
+Base = declarative_base(cls=AsyncAttrs)
+
+
+# Колода в двоичном формате (см. app.deck). Колоды, сохраненные до перехода на этот формат текстом,
+# при чтении преобразуются в двоичный формат
+class DeckBlob(TypeDecorator):
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return to_binary(value)
+
+    def process_result_value(self, value, dialect):
+        return to_binary(value)
 
 
 # Промежуточные модели для связи многие-ко-многим
@@ -25,6 +43,24 @@ class GameSetAssociation(Base):
     set_id = Column(Integer, ForeignKey("sets.id"), primary_key=True)
 
 
+# Связь карточек и хештегов, индексирована в обе стороны
+class CardHashtagAssociation(Base):
+    __tablename__ = "card_hashtag_association"
+    card_id = Column(Integer, ForeignKey("cards.id"), primary_key=True)
+    hashtag_id = Column(Integer, ForeignKey("hashtags.id"), primary_key=True)
+
+    __table_args__ = (Index("ix_card_hashtag_association_hashtag_id", "hashtag_id", "card_id"),)
+
+
+# Связь игр и хештегов
+class GameHashtagAssociation(Base):
+    __tablename__ = "game_hashtag_association"
+    game_id = Column(Integer, ForeignKey("games.id"), primary_key=True)
+    hashtag_id = Column(Integer, ForeignKey("hashtags.id"), primary_key=True)
+
+    __table_args__ = (Index("ix_game_hashtag_association_hashtag_id", "hashtag_id", "game_id"),)
+
+
 # Модель для админов
 class Admin(Base):
     __tablename__ = "admins"
@@ -47,6 +83,8 @@ class Category(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
     color = Column(String)
+    # Последний выданный номер карточки в категории. Номера не повторяются и после удаления карточек
+    card_seq = Column(Integer, nullable=False, default=0, server_default="0")
 
     sets = relationship("Set", back_populates="category")
     # Связь многие-ко-многим с играми
@@ -84,6 +122,9 @@ class Card(Base):
     # Связь многие-ко-многим с наборами
     sets = relationship("Set", secondary=SetCardAssociation.__table__, back_populates="cards")
 
+    # Связь многие-ко-многим с хештегами (hashtags хранит те же хештеги строкой для отображения)
+    tags = relationship("Hashtag", secondary=CardHashtagAssociation.__table__, back_populates="cards")
+
 
 # Модель для игр
 class Game(Base):
@@ -92,12 +133,44 @@ class Game(Base):
     name = Column(String, unique=True)
     status = Column(String, default="waiting")  # Статус игры (waiting, started, finished)
     start_time = Column(DateTime, nullable=True)
-    initial_deck = Column(String, nullable=True)
-    deck = Column(String, nullable=True)
+    # Зерно генератора вытягиваний запущенной игры
+    seed = Column(BigInteger, nullable=True)
+    initial_deck = Column(DeckBlob, nullable=True)
+    # Колода на момент запуска игры. Текущее состояние - эта колода после вытягиваний из журнала game_draws
+    deck = Column(DeckBlob, nullable=True)
     hashtags = Column(String, nullable=True)
 
+    # Для поиска запущенных игр с истекшим сроком
+    __table_args__ = (Index("ix_games_status_start_time", "status", "start_time"),)
+
     # Связь многие-ко-многим с категориями
     categories = relationship("Category", secondary=GameCategoryAssociation.__table__, back_populates="games")
 
     # Связь многие-ко-многим с наборами
     sets = relationship("Set", secondary=GameSetAssociation.__table__, back_populates="games")
+
+    # Связь многие-ко-многим с хештегами
+    tags = relationship("Hashtag", secondary=GameHashtagAssociation.__table__, back_populates="games")
+
+
+# Модель для хештегов
+class Hashtag(Base):
+    __tablename__ = "hashtags"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True)
+    # Число карточек с этим хештегом, обновляется при добавлении, изменении и удалении карточек
+    card_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+    cards = relationship("Card", secondary=CardHashtagAssociation.__table__, back_populates="tags")
+    games = relationship("Game", secondary=GameHashtagAssociation.__table__, back_populates="tags")
+
+
+# Журнал вытягиваний карточек запущенных игр, записи только добавляются.
+# seed отделяет записи разных запусков одной игры
+class GameDraw(Base):
+    __tablename__ = "game_draws"
+    game_id = Column(Integer, ForeignKey("games.id"), primary_key=True)
+    seed = Column(BigInteger, primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    category_id = Column(Integer, nullable=False)
+    card_id = Column(Integer, nullable=False)
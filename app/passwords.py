@@ -0,0 +1,47 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import bcrypt
+
+from app import config
+
+# Хеширование паролей bcrypt. Стоимость задается BCRYPT_ROUNDS, хеши с другой стоимостью
+# пересчитываются при следующем успешном входе.
+# Модуль bcrypt используется напрямую: passlib не поддерживает bcrypt 4 и при запуске выводит ошибку чтения версии
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+
+
+def make_password_hash(password: str) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(config.BCRYPT_ROUNDS)).decode()
+
+
+# Проверка пароля и пересчет хеша, если его стоимость отличается от BCRYPT_ROUNDS
+def verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    if not bcrypt.checkpw(password.encode(), password_hash.encode()):
+        return False, None
+    if int(password_hash[4:6]) != config.BCRYPT_ROUNDS:
+        return True, make_password_hash(password)
+    return True, None
+
+
+# Хеширование занимает десятки миллисекунд процессорного времени, поэтому выполняется в ограниченном пуле потоков,
+# а не в цикле событий (bcrypt отпускает GIL на время вычисления)
+executor = ThreadPoolExecutor(max_workers=config.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+# Является ли значение хешем пароля (а не паролем, сохраненным открытым текстом)
+def is_password_hash(value: Optional[str]) -> bool:
+    return bool(value) and len(value) == 60 and value.startswith(BCRYPT_PREFIXES) and value[4:6].isdigit()
+
+
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(executor, make_password_hash, password)
+
+
+# Проверка пароля. Возвращает (пароль верный, новый хеш - если хеш нужно пересчитать, иначе None)
+async def verify_password(password: str, password_hash: Optional[str]) -> Tuple[bool, Optional[str]]:
+    if not is_password_hash(password_hash):
+        return False, None
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, verify_and_update, password, password_hash)
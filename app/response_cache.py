@@ -0,0 +1,39 @@
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, Iterable, Tuple
+
+from app.store import GameStore
+
+
+# Кеш ответов тяжелых эндпоинтов чтения с вытеснением давно не использованных записей (LRU).
+# Запись хранится вместе с версиями таблиц, из которых построен ответ, и считается устаревшей,
+# как только эндпоинты изменения увеличат версию одной из этих таблиц
+class ResponseCache:
+    def __init__(self, store: GameStore, max_size: int):
+        self.store = store
+        self.max_size = max_size
+        # (эндпоинт, параметры) -> (версии таблиц, ответ)
+        self.entries: "OrderedDict[Tuple[str, Hashable], Tuple[dict, object]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Ответ из кеша или результат compute(). Исключения compute не кешируются
+    async def get(self, endpoint: str, params: Hashable, tables: Iterable[str],
+                  compute: Callable[[], Awaitable[object]]):
+        key = (endpoint, params)
+        versions = await self.store.get_versions(tables)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == versions:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = await compute()
+        if self.max_size > 0:
+            self.entries[key] = (versions, value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
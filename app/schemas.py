@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 
@@ -162,4 +162,17 @@ class GameEdit(BaseModel):
     name: str
     sets: List[int]
     categories: List[int]
-    hashtags: List[str]
\ No newline at end of file
+    hashtags: List[str]
+
+
+# Строка массового импорта карточек
+class CardImport(BaseModel):
+    category_id: int
+    description: str
+    hashtags: List[str] = []
+
+
+# Элемент пакетного вытягивания: count карточек из категории
+class CardDraw(BaseModel):
+    category_id: int
+    count: int = Field(1, ge=1)
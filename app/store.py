@@ -0,0 +1,344 @@
+import heapq
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.deck import Deck, draw_index
+
+
+# Хранилище состояния запущенных игр (колоды) и отозванных токенов.
+# Общее хранилище (Redis) позволяет нескольким воркерам обслуживать одни и те же игры
+class GameStore(ABC):
+    # Сохранение колоды игры целиком (при запуске игры или загрузке из базы данных).
+    # replace=False - колода сохраняется, только если ее еще нет в хранилище (ее мог восстановить
+    # другой воркер). Возвращает False, если колода не сохранена
+    @abstractmethod
+    async def save_deck(self, game_id: int, deck: Deck, replace: bool = True) -> bool:
+        ...
+
+    # Текущее состояние колоды, None - колоды нет в хранилище
+    @abstractmethod
+    async def load_deck(self, game_id: int) -> Optional[Deck]:
+        ...
+
+    # Атомарное вытягивание карточки из категории с пополнением из начальной колоды.
+    # Возвращает (зерно колоды, номер вытягивания в игре, id карточки). None - в категории нет карточек,
+    # KeyError - колоды нет в хранилище
+    @abstractmethod
+    async def draw(self, game_id: int, category_id: int) -> Optional[Tuple[int, int, int]]:
+        ...
+
+    # Атомарное вытягивание нескольких карточек: по одной из каждой категории списка, по порядку.
+    # Результат - как у draw для каждого элемента списка
+    @abstractmethod
+    async def draw_many(self, game_id: int, category_ids: List[int]) -> List[Optional[Tuple[int, int, int]]]:
+        ...
+
+    @abstractmethod
+    async def delete_deck(self, game_id: int):
+        ...
+
+    # Отзыв токена по его jti на ttl секунд (до истечения срока действия токена),
+    # после чего запись удаляется из хранилища
+    @abstractmethod
+    async def revoke_token(self, jti: str, ttl: int):
+        ...
+
+    @abstractmethod
+    async def is_token_revoked(self, jti: str) -> bool:
+        ...
+
+    # Версии таблиц для условных GET-запросов: увеличиваются после каждого изменения таблицы.
+    # Значение "epoch" меняется, если счетчики были потеряны (перезапуск, очистка Redis)
+    @abstractmethod
+    async def get_versions(self, tables: Iterable[str]) -> Dict[str, str]:
+        ...
+
+    @abstractmethod
+    async def bump_versions(self, tables: Iterable[str]):
+        ...
+
+    async def close(self):
+        pass
+
+
+# Хранилище в памяти процесса, подходит для одного воркера
+class MemoryGameStore(GameStore):
+    def __init__(self):
+        self.decks: Dict[int, Deck] = {}
+        # jti -> время истечения
+        self.revoked: Dict[str, float] = {}
+        # Куча (время истечения, jti) для удаления истекших записей
+        self.revoked_expiry: List[Tuple[float, str]] = []
+        self.versions: Dict[str, int] = {}
+        self.epoch = uuid.uuid4().hex
+
+    async def save_deck(self, game_id: int, deck: Deck, replace: bool = True) -> bool:
+        if not replace and game_id in self.decks:
+            return False
+        self.decks[game_id] = deck
+        return True
+
+    async def load_deck(self, game_id: int) -> Optional[Deck]:
+        return self.decks.get(game_id)
+
+    async def draw(self, game_id: int, category_id: int) -> Optional[Tuple[int, int, int]]:
+        return self.decks[game_id].draw_many([category_id])[0]
+
+    async def draw_many(self, game_id: int, category_ids: List[int]) -> List[Optional[Tuple[int, int, int]]]:
+        return self.decks[game_id].draw_many(category_ids)
+
+    async def delete_deck(self, game_id: int):
+        self.decks.pop(game_id, None)
+
+    # Удаление записей об отозванных токенах, срок действия которых истек.
+    # Число записей не превышает числа отозванных, но еще действующих токенов
+    def _evict_revoked(self, now: float):
+        while self.revoked_expiry and self.revoked_expiry[0][0] <= now:
+            expires, jti = heapq.heappop(self.revoked_expiry)
+            if self.revoked.get(jti) == expires:
+                del self.revoked[jti]
+
+    async def revoke_token(self, jti: str, ttl: int):
+        if ttl <= 0:
+            return
+        now = time.time()
+        self._evict_revoked(now)
+        expires = max(now + ttl, self.revoked.get(jti, 0))
+        self.revoked[jti] = expires
+        heapq.heappush(self.revoked_expiry, (expires, jti))
+
+    async def is_token_revoked(self, jti: str) -> bool:
+        expires = self.revoked.get(jti)
+        return expires is not None and expires > time.time()
+
+    async def get_versions(self, tables: Iterable[str]) -> Dict[str, str]:
+        versions = {table: str(self.versions.get(table, 0)) for table in tables}
+        versions["epoch"] = self.epoch
+        return versions
+
+    async def bump_versions(self, tables: Iterable[str]):
+        for table in tables:
+            self.versions[table] = self.versions.get(table, 0) + 1
+
+
+# Хранилище в Redis. Очередь и пул каждой категории - списки Redis, зерно и число вытягиваний - хеш state.
+# Вытягивание выполняется транзакцией под WATCH. Все ключи игры живут ttl секунд с последнего вытягивания
+class RedisGameStore(GameStore):
+    def __init__(self, url: str, ttl: int):
+        # Необязательная зависимость, нужна только при использовании Redis
+        import redis.asyncio as redis
+        from redis.exceptions import WatchError
+        self.redis = redis.from_url(url)
+        self.watch_error = WatchError
+        self.ttl = ttl
+
+    @staticmethod
+    def _categories_key(game_id: int) -> str:
+        return f'game:{game_id}:categories'
+
+    @staticmethod
+    def _state_key(game_id: int) -> str:
+        return f'game:{game_id}:state'
+
+    @staticmethod
+    def _queue_key(game_id: int, category_id: int) -> str:
+        return f'game:{game_id}:queue:{category_id}'
+
+    @staticmethod
+    def _pool_key(game_id: int, category_id: int) -> str:
+        return f'game:{game_id}:pool:{category_id}'
+
+    @staticmethod
+    def _parse_category_ids(value: Optional[bytes]) -> Optional[List[int]]:
+        if value is None:
+            return None
+        return [int(category_id) for category_id in value.split(b',') if category_id]
+
+    async def _category_ids(self, game_id: int):
+        return self._parse_category_ids(await self.redis.get(self._categories_key(game_id)))
+
+    def _delete_keys(self, pipe, game_id: int, category_ids):
+        pipe.delete(self._categories_key(game_id), self._state_key(game_id))
+        for category_id in category_ids:
+            pipe.delete(self._queue_key(game_id, category_id), self._pool_key(game_id, category_id))
+
+    # Все ключи игры продлеваются вместе, чтобы ни один из них не истек раньше остальных:
+    # иначе колода, восстановленная после истечения state, дописалась бы к оставшейся очереди
+    def _expire_keys(self, pipe, game_id: int, category_ids):
+        pipe.expire(self._categories_key(game_id), self.ttl)
+        pipe.expire(self._state_key(game_id), self.ttl)
+        for category_id in category_ids:
+            pipe.expire(self._queue_key(game_id, category_id), self.ttl)
+            pipe.expire(self._pool_key(game_id, category_id), self.ttl)
+
+    # Удаляются ключи и прежних категорий, и категорий новой колоды: список прежних категорий мог истечь
+    async def save_deck(self, game_id: int, deck: Deck, replace: bool = True) -> bool:
+        old_category_ids = await self._category_ids(game_id) or []
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if not replace:
+                await pipe.watch(self._state_key(game_id))
+                if await pipe.exists(self._state_key(game_id)):
+                    return False
+                pipe.multi()
+            self._delete_keys(pipe, game_id, dict.fromkeys([*old_category_ids, *deck.pools]))
+            pipe.set(self._categories_key(game_id), ','.join(map(str, deck.pools)))
+            pipe.hset(self._state_key(game_id), mapping={"seed": deck.seed, "draws": deck.draws})
+            for category_id, pool in deck.pools.items():
+                if pool:
+                    pipe.rpush(self._pool_key(game_id, category_id), *pool)
+                queue = deck.queues.get(category_id)
+                if queue:
+                    pipe.rpush(self._queue_key(game_id, category_id), *queue)
+            self._expire_keys(pipe, game_id, deck.pools)
+            try:
+                await pipe.execute()
+            except self.watch_error:
+                return False
+        return True
+
+    async def load_deck(self, game_id: int) -> Optional[Deck]:
+        category_ids = await self._category_ids(game_id)
+        if category_ids is None:
+            return None
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hmget(self._state_key(game_id), "seed", "draws")
+            for category_id in category_ids:
+                pipe.lrange(self._queue_key(game_id, category_id), 0, -1)
+                pipe.lrange(self._pool_key(game_id, category_id), 0, -1)
+            (seed, draws), *result = await pipe.execute()
+        queues = {}
+        pools = {}
+        for i, category_id in enumerate(category_ids):
+            queues[category_id] = [int(card_id) for card_id in result[2 * i]]
+            pools[category_id] = [int(card_id) for card_id in result[2 * i + 1]]
+        return Deck(queues, pools, int(seed or 0), int(draws or 0))
+
+    # Номер вытягивания берется из хеша state, поэтому вытягивания одной игры выполняются по очереди:
+    # транзакция повторяется, если другой воркер изменил очередь или число вытягиваний
+    async def draw(self, game_id: int, category_id: int) -> Optional[Tuple[int, int, int]]:
+        state_key = self._state_key(game_id)
+        queue_key = self._queue_key(game_id, category_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(state_key, queue_key)
+                    seed, draws = await pipe.hmget(state_key, "seed", "draws")
+                    if seed is None:
+                        raise KeyError(game_id)
+                    seq = int(draws)
+                    game_category_ids = self._parse_category_ids(await pipe.get(self._categories_key(game_id)))
+                    size = await pipe.llen(queue_key)
+                    refill = None
+                    if not size:
+                        # Очередь пуста - пополнение из пула
+                        refill = await pipe.lrange(self._pool_key(game_id, category_id), 0, -1)
+                        if not refill:
+                            return None
+                        size = len(refill)
+                    index = draw_index(int(seed), seq, size)
+                    if refill is None:
+                        card_id, last = await pipe.lindex(queue_key, index), await pipe.lindex(queue_key, -1)
+                        if card_id is None or last is None:
+                            # Очередь изменил другой воркер, WATCH отменил бы транзакцию
+                            await pipe.unwatch()
+                            continue
+                    else:
+                        card_id, last = refill[index], refill[-1]
+                    pipe.multi()
+                    if refill is None:
+                        pipe.lset(queue_key, index, last)
+                        pipe.rpop(queue_key)
+                    elif size > 1:
+                        refill[index] = last
+                        pipe.rpush(queue_key, *refill[:-1])
+                    pipe.hincrby(state_key, "draws", 1)
+                    self._expire_keys(pipe, game_id, game_category_ids or [])
+                    await pipe.execute()
+                    return int(seed), seq, int(card_id)
+                except self.watch_error:
+                    continue
+
+    # Очереди и пулы нужных категорий читаются под WATCH, вытягивания выполняются над их копией
+    # в памяти, и новые очереди записываются одной транзакцией
+    async def draw_many(self, game_id: int, category_ids: List[int]) -> List[Optional[Tuple[int, int, int]]]:
+        state_key = self._state_key(game_id)
+        categories = list(dict.fromkeys(category_ids))
+        queue_keys = {category_id: self._queue_key(game_id, category_id) for category_id in categories}
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(state_key, *queue_keys.values())
+                    seed, draws = await pipe.hmget(state_key, "seed", "draws")
+                    if seed is None:
+                        raise KeyError(game_id)
+                    game_category_ids = self._parse_category_ids(await pipe.get(self._categories_key(game_id)))
+                    queues = {}
+                    pools = {}
+                    for category_id in categories:
+                        queue = await pipe.lrange(queue_keys[category_id], 0, -1)
+                        pool = await pipe.lrange(self._pool_key(game_id, category_id), 0, -1)
+                        queues[category_id] = [int(card_id) for card_id in queue]
+                        pools[category_id] = [int(card_id) for card_id in pool]
+                    deck = Deck(queues, pools, int(seed), int(draws))
+                    drawn = deck.draw_many(category_ids)
+                    pipe.multi()
+                    for category_id in categories:
+                        pipe.delete(queue_keys[category_id])
+                        if deck.queues[category_id]:
+                            pipe.rpush(queue_keys[category_id], *deck.queues[category_id])
+                    pipe.hincrby(state_key, "draws", deck.draws - int(draws))
+                    self._expire_keys(pipe, game_id, game_category_ids or [])
+                    await pipe.execute()
+                    return drawn
+                except self.watch_error:
+                    continue
+
+    async def delete_deck(self, game_id: int):
+        category_ids = await self._category_ids(game_id)
+        if category_ids is None:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            self._delete_keys(pipe, game_id, category_ids)
+            await pipe.execute()
+
+    @staticmethod
+    def _revoked_key(jti: str) -> str:
+        return f'revoked:{jti}'
+
+    async def revoke_token(self, jti: str, ttl: int):
+        if ttl > 0:
+            await self.redis.set(self._revoked_key(jti), 1, ex=ttl)
+
+    async def is_token_revoked(self, jti: str) -> bool:
+        return bool(await self.redis.exists(self._revoked_key(jti)))
+
+    # Версии таблиц хранятся в хеше versions вместе с epoch, который создается заново, если хеш был удален
+    async def get_versions(self, tables: Iterable[str]) -> Dict[str, str]:
+        tables = list(tables)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hsetnx("versions", "epoch", uuid.uuid4().hex)
+            pipe.hmget("versions", "epoch", *tables)
+            _, values = await pipe.execute()
+        versions = {table: (value or b"0").decode() for table, value in zip(tables, values[1:])}
+        versions["epoch"] = values[0].decode()
+        return versions
+
+    async def bump_versions(self, tables: Iterable[str]):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for table in tables:
+                pipe.hincrby("versions", table, 1)
+            await pipe.execute()
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+# Создание хранилища по адресу: memory:// или redis://host:port/db
+def create_game_store(url: str, ttl: int) -> GameStore:
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisGameStore(url, ttl)
+    if url.startswith("memory://"):
+        return MemoryGameStore()
+    raise ValueError(f"Unsupported game store url: {url}")
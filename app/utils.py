@@ -1,3 +1,7 @@
+import hashlib
+import time
+import uuid
+
 import jwt
 from datetime import datetime, timedelta
 from fastapi import HTTPException, Security
@@ -14,9 +18,10 @@ ALGORITHM = "HS256"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
 
-# Функция для создания JWT токена
+# Функция для создания JWT токена. jti - уникальный идентификатор токена, по нему токен отзывается
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
+    to_encode["jti"] = uuid.uuid4().hex
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
@@ -26,15 +31,39 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-# Функция для проверки и декодирования токена
-def verify_access_token(token: str):
+# Проверка подписи и декодирование токена. verify_exp=False - для истекших токенов (например, при выходе)
+def decode_access_token(token: str, verify_exp: bool = True) -> dict:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        print(username)
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": verify_exp})
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
-    return username
+
+
+# Функция для проверки и декодирования токена
+def verify_access_token(token: str):
+    payload = decode_access_token(token)
+    return payload.get("sub")
+
+
+# Роль пользователя токена (admin или host). Токены без роли выдавались админу и ведущему с логинами admin и host
+def get_token_role(payload: dict) -> Optional[str]:
+    role = payload.get("role")
+    if role is None and payload.get("sub") in ("admin", "host"):
+        role = payload["sub"]
+    return role
+
+
+# Идентификатор токена для отзыва. У токенов, выданных до появления jti, - хеш самого токена
+def get_token_id(token: str, payload: dict) -> str:
+    return payload.get("jti") or hashlib.sha256(token.encode()).hexdigest()
+
+
+# Оставшийся срок действия токена в секундах
+def get_token_ttl(payload: dict) -> int:
+    exp = payload.get("exp")
+    if exp is None:
+        return int(timedelta(hours=1).total_seconds())
+    return max(0, int(exp - time.time()))
 
 
 '''def get_current_user(token: str = Security(oauth2_scheme)):
@@ -0,0 +1,49 @@
+import os
+import tempfile
+
+# Приложение читает настройки при импорте, поэтому тестовая база данных выбирается до импорта app
+os.environ["DATABASE_URL"] = f'sqlite:///{tempfile.mkdtemp()}/test.db'
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["GAME_STORE_URL"] = "memory://"
+os.environ["BCRYPT_ROUNDS"] = "4"
+os.environ["ADMIN_PASSWORD"] = ""
+
+from contextlib import contextmanager  # noqa: E402
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app.database import async_engine  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+# Подсчет SQL-запросов, выполненных движком внутри блока with
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    @contextmanager
+    def counting(self):
+        self.count = 0
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        try:
+            yield self
+        finally:
+            event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+# Клиент приложения, общий для всех тестов: база данных одна, поэтому тесты создают данные с уникальными именами
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def query_counter():
+    return QueryCounter(async_engine.sync_engine)
@@ -0,0 +1,58 @@
+import itertools
+import json
+from collections import Counter
+
+from app.importer import CardImporter
+
+names = itertools.count()
+
+
+def import_cards(client, rows):
+    body = "".join(f'{row}\n' for row in rows)
+    return client.post("/admin/importCards", content=body.encode()).json()
+
+
+def create_category(client) -> int:
+    return client.post("/admin/createCategory",
+                       json={"name": f"Import {next(names)}", "color": "#000"}).json()["category_id"]
+
+
+# Строка с неизвестной категорией получает одну ошибку, строка с ошибкой базы данных не отменяет остальные
+def test_failed_row_does_not_abort_batch(client, monkeypatch):
+    insert = CardImporter._insert
+
+    async def failing_insert(self, rows):
+        if any(card.description == "fail" for _, card in rows):
+            raise RuntimeError("insert failed")
+        await insert(self, rows)
+
+    monkeypatch.setattr(CardImporter, "_insert", failing_insert)
+    category_id = create_category(client)
+    result = import_cards(client, [
+        f'{{"category_id": {category_id}, "description": "first", "hashtags": []}}',
+        '{"category_id": 999999, "description": "lost", "hashtags": []}',
+        f'{{"category_id": {category_id}, "description": "fail", "hashtags": []}}',
+        f'{{"category_id": {category_id}, "description": "last", "hashtags": []}}',
+    ])
+    assert result == {"imported": 2, "errors": [
+        {"row": 2, "error": "Category not found"},
+        {"row": 3, "error": "Row failed: insert failed"},
+    ]}
+    cards = client.get("/admin/getCategoryData", params={"category_id": category_id}).json()["cards"]
+    assert sorted(card["description"] for card in cards) == ["first", "last"]
+
+
+def export_catalog(client):
+    return Counter(json.loads(line)["type"] for line in client.get("/admin/exportCatalog").text.splitlines() if line)
+
+
+# Повторный импорт выгрузки в ту же базу данных не добавляет карточки и связи
+def test_catalog_import_is_idempotent(client):
+    category_id = create_category(client)
+    import_cards(client, [f'{{"category_id": {category_id}, "description": "Card {i}", "hashtags": ["x"]}}'
+                          for i in range(6)])
+    exported = client.get("/admin/exportCatalog").content
+    before = export_catalog(client)
+    result = client.post("/admin/importCatalog", content=exported).json()
+    assert result["errors"] == []
+    assert export_catalog(client) == before
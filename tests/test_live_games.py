@@ -0,0 +1,160 @@
+import asyncio
+import itertools
+
+import httpx
+import pytest
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app.live_games import LiveGameRegistry
+from app.main import app, live_games, store
+from app.models import Card, Game, GameDraw
+from app.store import RedisGameStore
+
+CARDS = 30
+
+names = itertools.count()
+
+
+# Категория с cards карточками. Возвращает id категории и id карточек
+def create_category(client, cards: int = CARDS):
+    n = next(names)
+    category_id = client.post("/admin/createCategory",
+                              json={"name": f"Live {n}", "color": "#000"}).json()["category_id"]
+    body = "".join(f'{{"description": "Card {j}", "hashtags": ["live"]}}\n' for j in range(cards))
+    client.post("/admin/importCards", params={"category_id": category_id}, content=body.encode())
+    cards = client.get("/admin/getCategoryData", params={"category_id": category_id}).json()["cards"]
+    return category_id, [card["id"] for card in cards]
+
+
+def create_set(client, category_id: int, card_ids) -> int:
+    return client.post("/admin/addSetByCategoryID", json={
+        "name": f"Live set {next(names)}", "category_id": category_id, "cards": card_ids,
+    }).json()["set_id"]
+
+
+def game_body(sets, categories) -> dict:
+    return {"name": f"Live game {sets[0]}", "sets": sets, "categories": categories, "hashtags": ["live"]}
+
+
+# Категория с CARDS карточками, набор из всех ее карточек и игра с этим набором. Возвращает id игры и категории
+def create_game(client):
+    category_id, card_ids = create_category(client)
+    set_id = create_set(client, category_id, card_ids)
+    game_id = client.post("/admin/new-game", json=game_body([set_id], [category_id])).json()["id"]
+    return game_id, category_id
+
+
+# Журнал вытягиваний текущего запуска игры: номера карточек в порядке номеров вытягивания
+async def logged_cards(game_id: int):
+    await live_games.flush()
+    async with AsyncSessionLocal() as db:
+        seed = await db.scalar(select(Game.seed).where(Game.id == game_id))
+        rows = (await db.execute(
+            select(GameDraw.seq, GameDraw.category_id, Card.number).join(Card, Card.id == GameDraw.card_id)
+            .where(GameDraw.game_id == game_id, GameDraw.seed == seed).order_by(GameDraw.seq)
+        )).all()
+    return [seq for seq, _, _ in rows], [f"{category_id}.{number}" for _, category_id, number in rows]
+
+
+# Каждый цикл колоды (CARDS вытягиваний подряд) не содержит повторов, номера вытягиваний идут без пропусков
+def assert_no_duplicates(seqs, cards, draws):
+    assert seqs == list(range(draws))
+    for start in range(0, len(cards), CARDS):
+        cycle = cards[start:start + CARDS]
+        assert len(set(cycle)) == len(cycle)
+
+
+# Запросы отправляются одновременно. Запрос с retry повторяется, пока игра не запущена
+async def draw_concurrently(requests, retry: bool = False):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+        async def send(method, url, kwargs):
+            response = await http.request(method, url, **kwargs)
+            while retry and response.status_code == 400 and "not started" in response.text:
+                await asyncio.sleep(0)
+                response = await http.request(method, url, **kwargs)
+            return response
+
+        return await asyncio.gather(*[send(method, url, kwargs) for method, url, kwargs in requests])
+
+
+# Одновременные вытягивания в нескольких играх после потери состояния воркером
+def test_concurrent_draws_from_cold_state(client):
+    categories = dict(create_game(client) for _ in range(4))
+    games = list(categories)
+    for game_id in games:
+        assert client.post(f"/host/start-game/{game_id}").status_code == 200
+    for game_id in games:
+        live_games.games.pop(game_id, None)
+        client.portal.call(store.delete_deck, game_id)
+
+    draws = 100
+    responses = client.portal.call(draw_concurrently, [
+        ("POST", f"/game/draw-card/{game_id}", {"params": {"category_id": categories[game_id]}})
+        for _ in range(draws) for game_id in games
+    ])
+    assert {response.status_code for response in responses} == {200}
+    for i, game_id in enumerate(games):
+        seqs, cards = client.portal.call(logged_cards, game_id)
+        assert_no_duplicates(seqs, cards, draws)
+        assert sorted(cards) == sorted(response.json()["number"] for response in responses[i::len(games)])
+
+
+# Только один из одновременных запросов запускает игру
+def test_concurrent_starts(client):
+    game_id, _ = create_game(client)
+    responses = client.portal.call(draw_concurrently, [("POST", f"/host/start-game/{game_id}", {})] * 5)
+    assert sorted(response.status_code for response in responses) == [200, 400, 400, 400, 400]
+
+
+# Вытягивания, пришедшие одновременно с запуском игры, не повторяют карточки
+@pytest.mark.parametrize("run", range(10))
+def test_draws_racing_start(client, run):
+    game_id, category_id = create_game(client)
+    responses = client.portal.call(draw_concurrently, [("POST", f"/host/start-game/{game_id}", {})] + [
+        ("POST", f"/game/draw-card/{game_id}", {"params": {"category_id": category_id}})
+    ] * 40, True)
+    assert {response.status_code for response in responses} == {200}
+    seqs, cards = client.portal.call(logged_cards, game_id)
+    assert_no_duplicates(seqs, cards, 40)
+    # Выданные карточки совпадают с журналом
+    assert sorted(response.json()["number"] for response in responses[1:]) == sorted(cards)
+
+
+# Два воркера с общим хранилищем Redis
+@pytest.fixture
+def workers(client):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    registries = []
+    for _ in range(2):
+        redis_store = RedisGameStore("redis://localhost", 60)
+        redis_store.redis = fakeredis.aioredis.FakeRedis(server=server)
+        registries.append(LiveGameRegistry(redis_store, AsyncSessionLocal, 60, 1000))
+    yield registries
+    for registry in registries:
+        client.portal.call(registry.store.close)
+
+
+# Игру перезапустили с другими наборами и категориями через другой воркер:
+# данные игры в памяти воркера заменяются данными нового запуска
+def test_draws_after_restart_by_another_worker(client, workers):
+    first, second = workers
+    category_id, card_ids = create_category(client, 20)
+    added_category_id, added_card_ids = create_category(client, 5)
+    sets = [create_set(client, category_id, card_ids[:10])]
+    game_id = client.post("/admin/new-game", json=game_body(sets, [category_id])).json()["id"]
+    client.post(f"/host/start-game/{game_id}")
+    assert client.portal.call(second.draw, game_id, category_id) is not None
+    assert client.portal.call(first.draw, game_id, category_id) is not None
+
+    client.post(f"/host/finish-game/{game_id}")
+    client.portal.call(first.drop, game_id)
+    sets += [create_set(client, category_id, card_ids[10:]), create_set(client, added_category_id, added_card_ids)]
+    client.post(f"/admin/editGame/{game_id}", json=game_body(sets, [category_id, added_category_id]))
+    client.post(f"/host/start-game/{game_id}")
+    assert client.portal.call(first.draw, game_id, category_id) is not None
+
+    drawn = [client.portal.call(second.draw, game_id, category_id)["number"] for _ in range(19)]
+    assert len(set(drawn)) == 19
+    assert client.portal.call(second.draw, game_id, added_category_id)["number"].startswith(f"{added_category_id}.")
@@ -0,0 +1,66 @@
+import pytest
+
+# Максимальное число SQL-запросов на один запрос к эндпоинту чтения.
+# Число не должно зависеть от размера каталога, поэтому проверка выполняется на большом каталоге
+QUERY_BUDGETS = {
+    ("GET", "/admin/getCategories"): 1,
+    ("GET", "/admin/getCategoryData"): 3,
+    ("POST", "/admin/getSetInfo"): 2,
+    ("POST", "/admin/getCategoriesByGameID"): 2,
+    ("GET", "/admin/getgameInfo/{game_id}"): 7,
+    ("POST", "/admin/editGame/{game_id}"): 12,
+    ("GET", "/admin/getGames"): 1,
+    ("GET", "/host/getGames"): 1,
+    ("GET", "/admin/getHosts"): 1,
+    ("POST", "/admin/addCardByCategoryID"): 9,
+}
+
+CARDS = 2000
+CATEGORIES = 5
+
+
+# Синтетический каталог: категории с карточками, по набору в каждой категории, ведущий и игра
+@pytest.fixture(scope="module")
+def catalog(client):
+    category_ids = []
+    set_ids = []
+    for i in range(CATEGORIES):
+        category_id = client.post("/admin/createCategory",
+                                  json={"name": f"Budget {i}", "color": "#ffffff"}).json()["category_id"]
+        body = "".join(
+            f'{{"description": "Card {i}.{j}", "hashtags": ["tag{j % 10}", "tag{j % 7}"]}}\n'
+            for j in range(CARDS // CATEGORIES)
+        )
+        client.post("/admin/importCards", params={"category_id": category_id}, content=body.encode())
+        cards = client.get("/admin/getCategoryData", params={"category_id": category_id}).json()["cards"]
+        set_ids.append(client.post("/admin/addSetByCategoryID", json={
+            "name": f"Budget set {i}", "category_id": category_id, "cards": [card["id"] for card in cards[::2]],
+        }).json()["set_id"])
+        category_ids.append(category_id)
+    client.post("/admin/createHost", json={"login": "budget-host", "password": "password"})
+    game = {"name": "Budget game", "categories": category_ids, "sets": set_ids, "hashtags": ["tag1", "tag2"]}
+    game_id = client.post("/admin/new-game", json=game).json()["id"]
+    return {"category_id": category_ids[0], "set_id": set_ids[1], "game_id": game_id, "game": game}
+
+
+def _request(catalog, method, route):
+    game_id = catalog["game_id"]
+    return {
+        "/admin/getCategoryData": ("/admin/getCategoryData", {"params": {"category_id": catalog["category_id"]}}),
+        "/admin/getSetInfo": ("/admin/getSetInfo", {"params": {"set_id": catalog["set_id"]}}),
+        "/admin/getCategoriesByGameID": ("/admin/getCategoriesByGameID", {"params": {"game_id": game_id}}),
+        "/admin/getgameInfo/{game_id}": (f"/admin/getgameInfo/{game_id}", {}),
+        "/admin/editGame/{game_id}": (f"/admin/editGame/{game_id}", {"json": catalog["game"]}),
+        "/admin/addCardByCategoryID": ("/admin/addCardByCategoryID", {"json": {
+            "category_id": catalog["category_id"], "description": "Budget card", "hashtags": ["tag1", "new"],
+        }}),
+    }.get(route, (route, {}))
+
+
+@pytest.mark.parametrize("method, route", list(QUERY_BUDGETS))
+def test_query_budget(client, query_counter, catalog, method, route):
+    url, kwargs = _request(catalog, method, route)
+    with query_counter.counting():
+        response = client.request(method, url, **kwargs)
+    assert response.status_code == 200
+    assert query_counter.count <= QUERY_BUDGETS[(method, route)]
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from app.deck import Deck
+from app.store import GameStore, RedisGameStore
+
+fakeredis = pytest.importorskip("fakeredis")
+
+CARDS = [(1, 1), (2, 1), (3, 1), (4, 2), (5, 2)]
+
+
+def redis_store(ttl: int = 100) -> RedisGameStore:
+    store = RedisGameStore("redis://localhost", ttl)
+    store.redis = fakeredis.aioredis.FakeRedis()
+    return store
+
+
+def run(test):
+    async def main():
+        store = redis_store()
+        try:
+            await test(store)
+        finally:
+            await store.close()
+
+    asyncio.run(main())
+
+
+# Колода восстанавливается после истечения state и списка категорий, когда очередь еще не истекла
+def test_restore_after_state_expired():
+    async def test(store):
+        await store.save_deck(1, Deck.build(CARDS, 7))
+        await store.draw(1, 1)
+        await store.redis.delete(store._state_key(1), store._categories_key(1))
+        with pytest.raises(KeyError):
+            await store.draw(1, 1)
+
+        deck = Deck.build(CARDS, 7)
+        deck.draw(1)
+        assert await store.save_deck(1, deck, replace=False)
+        restored = await store.load_deck(1)
+        assert list(restored.queues[1]) == list(deck.queues[1])
+        assert restored.draws == 1
+
+    run(test)
+
+
+# Вытягивание продлевает срок жизни всех ключей игры, а не только измененных
+def test_draw_renews_all_keys():
+    async def test(store):
+        await store.save_deck(1, Deck.build(CARDS, 7))
+        keys = [store._categories_key(1), store._state_key(1), store._pool_key(1, 1), store._pool_key(1, 2),
+                store._queue_key(1, 1), store._queue_key(1, 2)]
+        for key in keys:
+            await store.redis.expire(key, 5)
+        await store.draw(1, 1)
+        assert [await store.redis.ttl(key) for key in keys] == [store.ttl] * len(keys)
+        for key in keys:
+            await store.redis.expire(key, 5)
+        await store.draw_many(1, [1, 2])
+        assert [await store.redis.ttl(key) for key in keys] == [store.ttl] * len(keys)
+
+    run(test)
+
+
+# Хранилище без реализации части методов не создается
+def test_incomplete_store_is_rejected():
+    class DeckOnlyStore(GameStore):
+        async def draw(self, game_id: int, category_id: int):
+            return None
+
+    with pytest.raises(TypeError):
+        DeckOnlyStore()